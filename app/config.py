@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+
+# NOTE: Every constant can be overridden with a `MYDAT_<NAME>` environment variable
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(f"MYDAT_{name}", default))
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(f"MYDAT_{name}", default)
+
+
+DATA_DIR = Path(_env_str("DATA_DIR", "app/db/data"))
+
+# Logging
+LOG_LEVEL = _env_str("LOG_LEVEL", "DEBUG").upper()
+# NOTE: "color" for a terminal, "json" for one uncolored JSON object per line in production
+LOG_FORMAT = _env_str("LOG_FORMAT", "color")
+
+# File uploads
+UPLOAD_DIR = DATA_DIR / "uploads"
+UPLOAD_MAX_BYTES = _env_int("UPLOAD_MAX_BYTES", 4 * 1024**3)
+UPLOAD_CHUNK_BYTES = _env_int("UPLOAD_CHUNK_BYTES", 1024**2)
+
+# Table store
+TABLES_DIR = DATA_DIR / "tables"
+
+# Resident user sessions
+SESSION_MAX_RESIDENT_BYTES = _env_int("SESSION_MAX_RESIDENT_BYTES", 2 * 1024**3)
+SESSION_IDLE_TTL_SECONDS = _env_int("SESSION_IDLE_TTL_SECONDS", 30 * 60)
+# NOTE: Users active this recently are never evicted so in-flight requests can't lose their changes
+SESSION_MIN_RESIDENT_SECONDS = _env_int("SESSION_MIN_RESIDENT_SECONDS", 60)
+
+# Write-behind persistence of user graphs
+CHECKPOINT_INTERVAL_SECONDS = _env_int("CHECKPOINT_INTERVAL_SECONDS", 5)
+
+# NOTE: "local" keeps each user's graph authoritative in one process and writes it back lazily,
+# "shared" writes every change through to the DB so any worker or replica can serve any user
+STATE_BACKEND = _env_str("STATE_BACKEND", "local")
+# NOTE: Benchmarks and load tests point this at a scratch database
+DATABASE_URL = _env_str("DATABASE_URL", f"sqlite+aiosqlite:///{DATA_DIR / 'main.db'}")
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+# SQLite connection pool
+SQLITE_POOL_SIZE = _env_int("SQLITE_POOL_SIZE", 5)
+SQLITE_POOL_MAX_OVERFLOW = _env_int("SQLITE_POOL_MAX_OVERFLOW", 5)
+SQLITE_POOL_TIMEOUT_SECONDS = _env_int("SQLITE_POOL_TIMEOUT_SECONDS", 10)
+
+# Materialized calculated tables
+MATERIALIZED_CACHE_MAX_BYTES = _env_int("MATERIALIZED_CACHE_MAX_BYTES", 1024**3)
+
+# Graph element changes kept to answer incremental `/graph/?since=` requests
+GRAPH_CHANGELOG_MAX_ENTRIES = _env_int("GRAPH_CHANGELOG_MAX_ENTRIES", 256)
+
+# Rendered charts
+CHART_CACHE_MAX_BYTES = _env_int("CHART_CACHE_MAX_BYTES", 256 * 1024**2)
+# NOTE: Set to 1 to spill charts evicted from memory to disk instead of dropping them
+CHART_CACHE_SPILL = bool(_env_int("CHART_CACHE_SPILL", 0))
+CHART_CACHE_SPILL_DIR = DATA_DIR / "chart_cache"
+CHART_CACHE_SPILL_MAX_BYTES = _env_int("CHART_CACHE_SPILL_MAX_BYTES", 1024**3)
+
+# Large scatter charts
+SCATTER_WEBGL_MIN_ROWS = _env_int("SCATTER_WEBGL_MIN_ROWS", 10_000)
+SCATTER_DECIMATE_MIN_ROWS = _env_int("SCATTER_DECIMATE_MIN_ROWS", 500_000)
+SCATTER_DECIMATE_TARGET_ROWS = _env_int("SCATTER_DECIMATE_TARGET_ROWS", 200_000)
+SCATTER_DECIMATE_GRID_SIZE = _env_int("SCATTER_DECIMATE_GRID_SIZE", 256)
+
+# Histograms
+HISTOGRAM_MAX_BINS = _env_int("HISTOGRAM_MAX_BINS", 1000)
+# NOTE: Defaults of new histograms, "count", "width", "sturges" or "freedman_diaconis"
+HISTOGRAM_BIN_RULE = _env_str("HISTOGRAM_BIN_RULE", "freedman_diaconis")
+HISTOGRAM_BIN_COUNT = _env_int("HISTOGRAM_BIN_COUNT", 30)
+
+# Heatmaps
+HEATMAP_MAX_CATEGORIES = _env_int("HEATMAP_MAX_CATEGORIES", 100)
+HEATMAP_CELLS_CACHE_MAX_BYTES = _env_int("HEATMAP_CELLS_CACHE_MAX_BYTES", 64 * 1024**2)
+
+# Templates
+# NOTE: Set to 0 in production, templates are then compiled once and never checked for changes
+TEMPLATES_AUTO_RELOAD = bool(_env_int("TEMPLATES_AUTO_RELOAD", 1))
+TEMPLATES_BYTECODE_DIR = DATA_DIR / "jinja_cache"
+
+# Compression of dynamic responses
+GZIP_MIN_BYTES = _env_int("GZIP_MIN_BYTES", 1024)
+# NOTE: Level 6 gets most of the size reduction of 9 at a fraction of the CPU cost
+GZIP_LEVEL = _env_int("GZIP_LEVEL", 6)
+
+# Table previews
+PREVIEW_PAGE_ROWS = _env_int("PREVIEW_PAGE_ROWS", 50)
+PREVIEW_MAX_PAGE_ROWS = _env_int("PREVIEW_MAX_PAGE_ROWS", 500)
+PREVIEW_SORT_CACHE_MAX_BYTES = _env_int("PREVIEW_SORT_CACHE_MAX_BYTES", 256 * 1024**2)
+
+# CPU-bound work offloaded from the event loop
+COMPUTE_MAX_WORKERS = _env_int("COMPUTE_MAX_WORKERS", os.cpu_count() or 4)
+# NOTE: Jobs waiting for a free worker beyond this are rejected with 503 instead of queueing up
+COMPUTE_MAX_QUEUED = _env_int("COMPUTE_MAX_QUEUED", 32)
+COMPUTE_RETRY_AFTER_SECONDS = _env_int("COMPUTE_RETRY_AFTER_SECONDS", 1)
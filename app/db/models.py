@@ -14,3 +14,5 @@ class UserData(Base):
         default=lambda: str(uuid.uuid4()),
     )
     graph_blob: Mapped[bytes] = mapped_column(nullable=False)
+    # NOTE: Mirrors `Graph.version` of the stored blob, compared on write for optimistic concurrency
+    version: Mapped[int] = mapped_column(nullable=False, default=0, server_default="0")
@@ -1,38 +1,78 @@
-from collections.abc import Generator
-from contextlib import contextmanager
-from typing import Annotated
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Any
 
 import sqlalchemy as sa
-from fastapi import Depends
-from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = "sqlite:///app/db/data/main.db"
+from app.config import (
+    DATABASE_URL,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_POOL_MAX_OVERFLOW,
+    SQLITE_POOL_SIZE,
+    SQLITE_POOL_TIMEOUT_SECONDS,
+)
 
-engine = sa.create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=SQLITE_POOL_SIZE,
+    max_overflow=SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=SQLITE_POOL_TIMEOUT_SECONDS,
+)
+SessionLocal = async_sessionmaker(
     autoflush=True,
     bind=engine,
+    expire_on_commit=False,
 )
 
 
+@sa.event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection: Any, _: Any) -> None:
+    # NOTE: WAL lets readers in every worker proceed while another worker writes, and in WAL mode
+    # synchronous=NORMAL only syncs at checkpoints while still never corrupting the database
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
 class Base(DeclarativeBase):
     pass
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+# NOTE: Sessions are only opened where the DB is actually needed, never per request
+get_db_context = asynccontextmanager(get_db)
 
 
-# NOTE: Only needed to invoke DB session in FastAPI lifespan for shutdown event
-get_db_context = contextmanager(get_db)
+async def create_db_and_tables() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
 
 
-def create_db_and_tables() -> None:
-    Base.metadata.create_all(bind=engine)
+def _add_missing_columns(conn: sa.Connection) -> None:
+    # NOTE: `create_all` never alters existing tables, so columns added later are patched in here
+    inspector = sa.inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+            try:
+                conn.execute(sa.text(ddl))
+            except sa.exc.OperationalError:
+                # NOTE: Another worker starting up at the same time may have added it first
+                pass
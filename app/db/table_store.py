@@ -0,0 +1,57 @@
+import os
+import uuid
+from pathlib import Path
+
+import polars as pl
+
+from app.config import TABLES_DIR
+
+
+class TableStore:
+    def __init__(self, root: Path) -> None:
+        """Write-once columnar storage of tables as uncompressed Arrow IPC files."""
+        self._root = root
+
+    def _path(self, table_id: str) -> Path:
+        return self._root / f"{table_id}.arrow"
+
+    def _new_table(self) -> tuple[str, Path, Path]:
+        self._root.mkdir(parents=True, exist_ok=True)
+        table_id = str(uuid.uuid4())
+        path = self._path(table_id)
+        return table_id, path, path.with_suffix(".tmp")
+
+    def write(self, df: pl.DataFrame) -> str:
+        table_id, path, tmp_path = self._new_table()
+        try:
+            # NOTE: Uncompressed so that reads can memory-map the file instead of decoding it
+            df.write_ipc(tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return table_id
+
+    def sink_csv(self, csv_path: Path) -> str:
+        # NOTE: Streams the CSV straight into IPC without ever materializing the table
+        table_id, path, tmp_path = self._new_table()
+        try:
+            pl.scan_csv(csv_path).sink_ipc(tmp_path, compression=None)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # NOTE: A CSV that fails to parse must not leave a partial file behind
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return table_id
+
+    def read(self, table_id: str) -> pl.DataFrame:
+        return pl.read_ipc(self._path(table_id), memory_map=True)
+
+    def scan(self, table_id: str) -> pl.LazyFrame:
+        return pl.scan_ipc(self._path(table_id), memory_map=True)
+
+    def delete(self, table_id: str) -> None:
+        self._path(table_id).unlink(missing_ok=True)
+
+
+table_store = TableStore(TABLES_DIR)
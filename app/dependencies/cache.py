@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+V = TypeVar("V")
+
+
+class SizedLRUCache(Generic[V]):
+    def __init__(self, max_bytes: int, sizeof: Callable[[V], int]) -> None:
+        """LRU cache that evicts the oldest entries once their total size exceeds `max_bytes`."""
+        self._entries: OrderedDict[str, tuple[V, int]] = OrderedDict()
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        # NOTE: Entries are read and filled from compute pool threads as well as the event loop
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value: V) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            self.pop(key)
+            # NOTE: Values that can never fit would just flush the whole cache
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self._max_bytes:
+                evicted_key, (evicted, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self._on_evict(evicted_key, evicted)
+
+    def pop(self, key: str) -> V | None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.total_bytes -= entry[1]
+            return entry[0]
+
+    def _on_evict(self, key: str, value: V) -> None:
+        pass
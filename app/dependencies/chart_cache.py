@@ -0,0 +1,131 @@
+import copy
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+import plotly.io as pio
+
+from app.config import (
+    CHART_CACHE_MAX_BYTES,
+    CHART_CACHE_SPILL,
+    CHART_CACHE_SPILL_DIR,
+    CHART_CACHE_SPILL_MAX_BYTES,
+)
+from app.dependencies.cache import SizedLRUCache
+from app.dependencies.compute import compute_pool
+from app.dependencies.metrics import Stage, stage_timer
+from app.dependencies.specs.chart import DataChart, fig_html
+from app.dependencies.specs.graph import Graph, TableSource
+
+
+class ChartCache(SizedLRUCache[str]):
+    def __init__(self, max_bytes: int, spill_dir: Path | None, spill_max_bytes: int) -> None:
+        """Rendered chart HTML keyed by content fingerprint, optionally spilling evicted entries to disk."""
+        super().__init__(max_bytes, len)
+        self._spill_root = spill_dir
+        # NOTE: One directory per worker process, so workers never delete each other's files
+        self._spill_dir = None if spill_dir is None else spill_dir / str(os.getpid())
+        self._spill_max_bytes = spill_max_bytes
+        # NOTE: Spilled keys in LRU order with their sizes, capped at `spill_max_bytes` like memory is
+        self._spilled: OrderedDict[str, int] = OrderedDict()
+        self.spilled_bytes = 0
+
+    def _spill_path(self, key: str) -> Path:
+        assert self._spill_dir is not None
+        return self._spill_dir / f"{key}.html"
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            chart_html = super().get(key)
+            if chart_html is not None or key not in self._spilled:
+                return chart_html
+            self.spilled_bytes -= self._spilled.pop(key)
+            spill_path = self._spill_path(key)
+            chart_html = spill_path.read_text()
+            spill_path.unlink(missing_ok=True)
+            self.misses -= 1
+            self.hits += 1
+            self.put(key, chart_html)
+            return chart_html
+
+    def _on_evict(self, key: str, value: str) -> None:
+        size = self._sizeof(value)
+        if self._spill_dir is None or size > self._spill_max_bytes:
+            return
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+        self._spill_path(key).write_text(value)
+        self.spilled_bytes += size - self._spilled.pop(key, 0)
+        self._spilled[key] = size
+        while self.spilled_bytes > self._spill_max_bytes:
+            evicted_key, evicted_size = self._spilled.popitem(last=False)
+            self.spilled_bytes -= evicted_size
+            self._spill_path(evicted_key).unlink(missing_ok=True)
+
+    def remove_stale_spills(self) -> int:
+        """Delete spill directories left behind by worker processes that no longer run."""
+        if self._spill_root is None or not self._spill_root.is_dir():
+            return 0
+        n_removed = 0
+        for path in self._spill_root.iterdir():
+            if path.is_dir() and path.name.isdigit() and _pid_alive(int(path.name)):
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                # NOTE: Files spilled before there was a directory per process
+                path.unlink(missing_ok=True)
+            n_removed += 1
+        return n_removed
+
+    def remove_spilled(self) -> None:
+        with self._lock:
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spilled.clear()
+            self.spilled_bytes = 0
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # NOTE: Exists but belongs to another user
+        return True
+    return True
+
+
+chart_cache = ChartCache(
+    CHART_CACHE_MAX_BYTES,
+    CHART_CACHE_SPILL_DIR if CHART_CACHE_SPILL else None,
+    CHART_CACHE_SPILL_MAX_BYTES,
+)
+
+
+def render_chart(chart: DataChart, source: TableSource) -> str:
+    df = source.collect()
+    with stage_timer(Stage.MAKE_FIG):
+        # NOTE: The fingerprint identifies the rows of `df` for charts that cache aggregations of it
+        fig = chart.make_fig(df, source.fingerprint)
+    with stage_timer(Stage.FIG_HTML):
+        return fig_html(fig)
+
+
+async def get_chart_html(g: Graph, chart_id: str) -> str:
+    # NOTE: Fingerprint covers the chart spec and the content of every upstream table and analysis
+    key = f"{g.fingerprint(chart_id)}-{pio.templates.default}"
+    chart_html = chart_cache.get(key)
+    if chart_html is None:
+        chart = g.get_node_data(chart_id).data
+        assert isinstance(chart, DataChart)
+        chart_parent_id, _ = g.get_parents(chart_id)[0]
+        # NOTE: The graph is only read here on the event loop, the pool gets a copy of the spec
+        # (a concurrent `/charts/update` can't change it mid-render) and the resolved source
+        source = g.table_source(chart_parent_id)
+        chart_html = await compute_pool.run(render_chart, copy.deepcopy(chart), source)
+        chart_cache.put(key, chart_html)
+    return chart_html
@@ -0,0 +1,55 @@
+import asyncio
+import functools
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import ParamSpec, TypeVar
+
+from fastapi import HTTPException, status
+
+from app.config import COMPUTE_MAX_QUEUED, COMPUTE_MAX_WORKERS, COMPUTE_RETRY_AFTER_SECONDS
+from app.middlewares.custom_logging import logger
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class ComputePool:
+    def __init__(self, max_workers: int, max_queued: int) -> None:
+        """Bounded executor for Polars, plotly and CSV work that would otherwise block the event loop.
+
+        Threads rather than processes: Polars releases the GIL and graphs can't cross process
+        boundaries cheaply. Once `max_workers + max_queued` jobs are in flight new jobs fail fast.
+        """
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="compute")
+        self._max_workers = max_workers
+        self._max_in_flight = max_workers + max_queued
+        # NOTE: Only touched from the event loop thread so it needs no lock
+        self.in_flight = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self._max_workers)
+
+    async def run(self, fn: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+        if self.in_flight >= self._max_in_flight:
+            self.rejected += 1
+            logger.warning("Compute pool saturated with %s jobs, rejecting %s", self.in_flight, fn.__name__)
+            raise HTTPException(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy, try again shortly",
+                headers={"Retry-After": str(COMPUTE_RETRY_AFTER_SECONDS)},
+            )
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+compute_pool = ComputePool(COMPUTE_MAX_WORKERS, COMPUTE_MAX_QUEUED)
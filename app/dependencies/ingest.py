@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from fastapi import HTTPException, UploadFile, status
+
+from app.config import (
+    UPLOAD_CHUNK_BYTES,
+    UPLOAD_DIR,
+    UPLOAD_MAX_BYTES,
+)
+from app.db.table_store import table_store
+from app.dependencies.compute import compute_pool
+from app.dependencies.metrics import Stage, stage_timer
+from app.dependencies.specs.table import StoredTable
+from app.middlewares.custom_logging import logger
+
+# NOTE: Per-process descriptor directory on Linux and macOS, opening an entry opens the same file
+FD_DIR = Path("/dev/fd")
+
+
+def _reject_too_large(size: int) -> HTTPException:
+    logger.error("Upload of %s bytes exceeds limit of %s bytes", size, UPLOAD_MAX_BYTES)
+    return HTTPException(
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        f"File exceeds upload limit of {UPLOAD_MAX_BYTES} bytes",
+    )
+
+
+def rolled_upload_path(src: BinaryIO) -> Path | None:
+    """Path the CSV reader can scan an upload at in place, `None` while it is still in memory."""
+    # NOTE: Starlette spools file parts to a `SpooledTemporaryFile`, past its memory limit that is an
+    # unnamed temp file on disk, only reachable through its descriptor
+    if not getattr(src, "_rolled", False) or not FD_DIR.is_dir():
+        return None
+    src.seek(0)
+    return FD_DIR / str(src.fileno())
+
+
+def spool_upload(src: BinaryIO, suffix: str) -> Path:
+    """Write an upload Starlette still holds in memory to a named file the CSV reader can scan."""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=suffix, delete=False) as spool:
+        spool_path = Path(spool.name)
+        try:
+            src.seek(0)
+            shutil.copyfileobj(src, spool, UPLOAD_CHUNK_BYTES)
+        except BaseException:
+            spool.close()
+            spool_path.unlink(missing_ok=True)
+            raise
+    return spool_path
+
+
+def store_csv(path: Path) -> StoredTable:
+    # NOTE: Column stats are built from the memory-mapped result, once, at ingest time
+    with stage_timer(Stage.CSV_PARSE):
+        return StoredTable.from_store(table_store.sink_csv(path))
+
+
+def store_upload(src: BinaryIO, suffix: str) -> StoredTable:
+    # NOTE: Large uploads are already on disk and are scanned where they are, never copied again
+    rolled_path = rolled_upload_path(src)
+    if rolled_path is not None:
+        return store_csv(rolled_path)
+
+    spool_path = spool_upload(src, suffix)
+    try:
+        return store_csv(spool_path)
+    finally:
+        spool_path.unlink(missing_ok=True)
+
+
+async def ingest_csv(uploaded_file: UploadFile) -> StoredTable:
+    """Parse an upload into the table store off the event loop."""
+    # NOTE: `UploadLimitMiddleware` already rejected oversized bodies before they were parsed
+    if uploaded_file.size is not None and uploaded_file.size > UPLOAD_MAX_BYTES:
+        raise _reject_too_large(uploaded_file.size)
+
+    logger.debug("Ingesting %s (%s bytes)", uploaded_file.filename, uploaded_file.size)
+    # NOTE: Spooling a small upload and parsing it both block, so they are a single pool job
+    suffix = Path(uploaded_file.filename or "").suffix
+    return await compute_pool.run(store_upload, uploaded_file.file, suffix)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from enum import StrEnum, auto
+
+# NOTE: Seconds, from a cache hit up to a cold render of a large table
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Stage(StrEnum):
+    CSV_PARSE = auto()
+    ANALYSIS_APPLY = auto()
+    MAKE_FIG = auto()
+    FIG_HTML = auto()
+    RENDER = auto()
+    DB_LOAD = auto()
+    DB_PERSIST = auto()
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...]) -> None:
+        """Cumulative Prometheus histogram, only formatted as text when scraped."""
+        self.name = name
+        self._help_text = help_text
+        self._label_names = label_names
+        # NOTE: Per label set: count per bucket (not cumulative), then +Inf count, then sum
+        self._series: dict[tuple[str, ...], list[float]] = {}
+        # NOTE: Stages are timed from compute pool threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+            for i, upper in enumerate(LATENCY_BUCKETS):
+                if value <= upper:
+                    series[i] += 1
+                    break
+            else:
+                series[-2] += 1
+            series[-1] += value
+
+    def expose(self) -> list[str]:
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        lines = [f"# HELP {self.name} {self._help_text}", f"# TYPE {self.name} histogram"]
+        for labels, values in sorted(series.items()):
+            label_str = ",".join(f'{k}="{v}"' for k, v in zip(self._label_names, labels))
+            cumulative = 0
+            for upper, count in zip([*LATENCY_BUCKETS, "+Inf"], values[:-1]):
+                cumulative += int(count)
+                lines.append(f'{self.name}_bucket{{{label_str},le="{upper}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_str}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{label_str}}} {cumulative}")
+        return lines
+
+
+def format_metric(name: str, kind: str, help_text: str, samples: dict[str, float]) -> list[str]:
+    """Text exposition of a gauge or counter, `samples` maps label strings to values."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples.items():
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+request_latency = Histogram(
+    "mydat_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"),
+)
+stage_latency = Histogram(
+    "mydat_stage_duration_seconds",
+    "Time spent in one processing stage of a request.",
+    ("stage",),
+)
+
+
+@contextmanager
+def stage_timer(stage: Stage) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage.value)
@@ -0,0 +1,280 @@
+import dataclasses
+import pickle
+import struct
+import zlib
+from collections.abc import Callable
+from enum import StrEnum
+from itertools import islice
+from operator import attrgetter
+from types import NoneType, UnionType
+from typing import Any, Union, get_args, get_origin, get_type_hints
+
+import orjson
+import polars as pl
+
+from app.dependencies.specs.analysis import (
+    DataAnalysis,
+    FilterPredicate,
+    KindAnalysis,
+    TableCol,
+)
+from app.dependencies.specs.chart import ChartKind, DataChart, DimensionValue
+from app.dependencies.specs.graph import Graph, GraphNode, KindNode, SubkindNode
+from app.dependencies.specs.table import (
+    ColumnStats,
+    DerivedTable,
+    KindTable,
+    StoredTable,
+    TableStats,
+)
+
+# Layout: MAGIC | format version (uint16, big-endian) | zlib compressed orjson payload
+# NOTE: Table rows are never part of the blob, table nodes only reference the table store
+MAGIC = b"MYDAT\x00"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct(">H")
+# NOTE: Column names repeat across stats and chart options, level 3 already shrinks blobs ~10x and
+# decompresses in about a millisecond per 1000 nodes
+_COMPRESS_LEVEL = 3
+
+Payload = dict[str, Any]
+
+# NOTE: A spec is a positional list `[type index, *init field values]` and a list of specs of one
+# type is stored by column, `[type index, *field columns]`. The payload lists the field names of
+# every type once, so a blob written before a field was added or removed still loads (unknown
+# fields are dropped, missing ones use their defaults). Enums are plain values restored from the
+# type hints of the fields holding them
+_SPEC_TYPES: list[type] = [
+    StoredTable,
+    DerivedTable,
+    TableStats,
+    ColumnStats,
+    TableCol,
+    FilterPredicate,
+    DimensionValue,
+    *DataAnalysis.__args__,
+    *DataChart.__args__,
+]
+# NOTE: Enum members by value, looking them up is much faster than calling the enum class
+_KINDS: dict[str, KindNode] = {kind.value: kind for kind in KindNode}
+_SUBKINDS: dict[KindNode, dict[str, SubkindNode]] = {
+    kind: {subkind.value: subkind for subkind in subkind_cls}
+    for kind, subkind_cls in [
+        (KindNode.TABLE, KindTable),
+        (KindNode.ANALYSIS, KindAnalysis),
+        (KindNode.CHART, ChartKind),
+    ]
+}
+
+# How a field value is encoded beyond what orjson does on its own, `None` for plain values
+_SPEC = "spec"
+_SPEC_COLUMNS = "spec_columns"
+_POLARS_FN = "polars_fn"
+ValueKind = str | type[StrEnum] | None
+Codec = Callable[[Any], Any]
+
+
+def _value_kind(hint: Any) -> ValueKind:
+    origin = get_origin(hint)
+    if origin in (Union, UnionType):
+        args = [a for a in get_args(hint) if a is not NoneType]
+        if all(a in _SPEC_TYPES for a in args):
+            return _SPEC
+        return _value_kind(args[0]) if len(args) == 1 else None
+    if hint in _SPEC_TYPES:
+        return _SPEC
+    if isinstance(hint, type) and issubclass(hint, StrEnum):
+        return hint
+    if origin is list:
+        (item,) = get_args(hint)
+        assert _value_kind(item) in (None, _SPEC), f"Unsupported list field {hint}"
+        return _SPEC_COLUMNS if item in _SPEC_TYPES else None
+    if hint is Callable or origin is Callable:
+        # NOTE: Aggregation functions of chart specs, e.g. `pl.len`
+        return _POLARS_FN
+    return None
+
+
+# NOTE: Fields with `init=False` are runtime caches and never part of the spec
+_FIELD_KINDS: dict[type, dict[str, ValueKind]] = {
+    cls: {f.name: _value_kind(get_type_hints(cls)[f.name]) for f in dataclasses.fields(cls) if f.init}
+    for cls in _SPEC_TYPES
+}
+_TYPE_LAYOUT = [[cls.__name__, list(_FIELD_KINDS[cls])] for cls in _SPEC_TYPES]
+
+# NOTE: Each entry upgrades a decoded payload from format version `n` to `n + 1`
+_UPGRADES: dict[int, Callable[[Payload], Payload]] = {}
+
+
+def _encode_spec(obj: Any) -> list[Any]:
+    type_index, get_fields, encoders = _ENCODERS[type(obj)]
+    encoded = [type_index, *get_fields(obj)]
+    for i, encode in encoders:
+        if encoded[i] is not None:
+            encoded[i] = encode(encoded[i])
+    return encoded
+
+
+def _encode_spec_columns(objs: list[Any]) -> list[Any]:
+    if not objs:
+        return []
+    type_index, get_fields, encoders = _ENCODERS[type(objs[0])]
+    encoded: list[Any] = [type_index, *map(list, zip(*map(get_fields, objs)))]
+    for i, encode in encoders:
+        encoded[i] = [v if v is None else encode(v) for v in encoded[i]]
+    return encoded
+
+
+_ENCODER_OF_KIND: dict[str, Codec] = {
+    _SPEC: _encode_spec,
+    _SPEC_COLUMNS: _encode_spec_columns,
+    _POLARS_FN: attrgetter("__name__"),
+}
+
+
+def _fields_getter(names: list[str]) -> Callable[[Any], tuple[Any, ...]]:
+    if len(names) == 1:
+        return lambda obj: (getattr(obj, names[0]),)
+    return attrgetter(*names) if names else lambda obj: ()
+
+
+# NOTE: Per type, its index, a getter of all field values and the encoders of the fields orjson
+# can't write as they are, by their position in the encoded spec
+_ENCODERS: dict[type, tuple[int, Callable[[Any], tuple[Any, ...]], list[tuple[int, Codec]]]] = {
+    cls: (
+        type_index,
+        _fields_getter(list(_FIELD_KINDS[cls])),
+        [
+            (i, _ENCODER_OF_KIND[kind])
+            for i, kind in enumerate(_FIELD_KINDS[cls].values(), start=1)
+            if isinstance(kind, str)
+        ],
+    )
+    for type_index, cls in enumerate(_SPEC_TYPES)
+}
+
+
+class _SpecDecoder:
+    """Decodes the specs of one payload with the field layout that payload was written with."""
+
+    def __init__(self, layout: list[list[Any]]) -> None:
+        by_name = {cls.__name__: cls for cls in _SPEC_TYPES}
+        # NOTE: Field names are `None` when the fields can be passed positionally
+        self.types: list[tuple[type, list[str | None] | None, list[tuple[int, Codec]]]] = []
+        for type_name, field_names in layout:
+            cls = by_name[type_name]
+            kinds = _FIELD_KINDS[cls]
+            decoders = [
+                (i, self._decoder(kinds[name]))
+                for i, name in enumerate(field_names, start=1)
+                if kinds.get(name) is not None
+            ]
+            positional = field_names == list(kinds)[: len(field_names)]
+            names = None if positional else [name if name in kinds else None for name in field_names]
+            self.types.append((cls, names, decoders))
+
+    def _decoder(self, kind: ValueKind) -> Codec:
+        if isinstance(kind, type):
+            return {member.value: member for member in kind}.__getitem__
+        if kind == _SPEC:
+            return self.spec
+        if kind == _SPEC_COLUMNS:
+            return self.spec_columns
+        assert kind == _POLARS_FN
+        return lambda name: getattr(pl, name)
+
+    def spec(self, encoded: list[Any]) -> Any:
+        cls, names, decoders = self.types[encoded[0]]
+        for i, decode in decoders:
+            if encoded[i] is not None:
+                encoded[i] = decode(encoded[i])
+        if names is None:
+            return cls(*islice(encoded, 1, None))
+        return cls(**{name: v for name, v in zip(names, islice(encoded, 1, None)) if name is not None})
+
+    def spec_columns(self, encoded: list[Any]) -> list[Any]:
+        if not encoded:
+            return []
+        cls, names, decoders = self.types[encoded[0]]
+        for i, decode in decoders:
+            encoded[i] = [v if v is None else decode(v) for v in encoded[i]]
+        if names is None:
+            return list(map(cls, *islice(encoded, 1, None)))
+        columns = {name: column for name, column in zip(names, islice(encoded, 1, None)) if name}
+        return [cls(**dict(zip(columns, values))) for values in zip(*columns.values())]
+
+
+def _positional_from_tagged(payload: Payload) -> Payload:
+    """Version 1 tagged every spec with `__type__` and every enum with `__enum__`."""
+    layout: dict[str, tuple[int, list[str]]] = {}
+
+    def fields(obj: dict[str, Any]) -> tuple[int, list[str]]:
+        return layout.setdefault(obj["__type__"], (len(layout), [k for k in obj if k != "__type__"]))
+
+    def convert(obj: Any) -> Any:
+        if isinstance(obj, list):
+            if obj and isinstance(obj[0], dict) and "__type__" in obj[0]:
+                type_index, field_names = fields(obj[0])
+                return [type_index, *([convert(o.get(k)) for o in obj] for k in field_names)]
+            return obj
+        if not isinstance(obj, dict):
+            return obj
+        if "__enum__" in obj:
+            return obj["value"]
+        if "__polars_fn__" in obj:
+            return obj["__polars_fn__"]
+        type_index, field_names = fields(obj)
+        return [type_index, *(convert(obj.get(k)) for k in field_names)]
+
+    nodes = [
+        [node_id, node["name"], node["kind"]["value"], node["subkind"]["value"], convert(node["data"])]
+        for node_id, node in payload["nodes"]
+    ]
+    return {
+        "version": payload["version"],
+        "types": [[type_name, field_names] for type_name, (_, field_names) in layout.items()],
+        "nodes": nodes,
+        "edges": payload["edges"],
+    }
+
+
+_UPGRADES[1] = _positional_from_tagged
+
+
+def dump_graph(graph: Graph) -> bytes:
+    payload = {
+        "version": graph.version,
+        "types": _TYPE_LAYOUT,
+        "nodes": [
+            [node_id, rec.node.name, rec.node.kind, rec.node.subkind, _encode_spec(rec.node.data)]
+            for node_id, rec in graph.nodes.items()
+        ],
+        "edges": graph.edges(),
+    }
+    return MAGIC + _HEADER.pack(FORMAT_VERSION) + zlib.compress(orjson.dumps(payload), _COMPRESS_LEVEL)
+
+
+def load_graph(blob: bytes) -> Graph:
+    if not blob.startswith(MAGIC):
+        # NOTE: Blobs written before this format existed are plain pickles of `Graph`
+        graph: Graph = pickle.loads(blob)
+        return graph
+
+    (format_version,) = _HEADER.unpack_from(blob, len(MAGIC))
+    if format_version > FORMAT_VERSION:
+        raise ValueError(
+            f"Graph blob has format version {format_version}, newest known is {FORMAT_VERSION}",
+        )
+
+    body = blob[len(MAGIC) + _HEADER.size :]
+    # NOTE: Version 1 payloads were written uncompressed
+    payload: Payload = orjson.loads(zlib.decompress(body) if format_version > 1 else body)
+    for v in range(format_version, FORMAT_VERSION):
+        payload = _UPGRADES[v](payload)
+
+    decoder = _SpecDecoder(payload["types"])
+    nodes = []
+    for node_id, name, kind_value, subkind, data in payload["nodes"]:
+        kind = _KINDS[kind_value]
+        nodes.append((node_id, GraphNode(name, kind, _SUBKINDS[kind][subkind], decoder.spec(data))))
+    return Graph.restore(payload["version"], nodes, payload["edges"])
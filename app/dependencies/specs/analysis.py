@@ -5,6 +5,11 @@ from typing import Any, Self
 
 import polars as pl
 
+from app.dependencies.specs.table import ColumnStats, DtypeClass, TableStats
+
+# NOTE: Every integer up to this magnitude is exactly representable as a float
+_MAX_EXACT_FLOAT_INT = 2**53
+
 
 class KindAnalysis(StrEnum):
     FILTER = auto()
@@ -61,6 +66,47 @@ class FilterPredicate:
             "",
         )
 
+    def decide(self, stats: ColumnStats | None) -> bool | None:
+        """Whether column stats prove this predicate true for every row, false for every row, or neither."""
+        if (
+            stats is None
+            or stats.dtype_class != DtypeClass.NUMERIC
+            or stats.min is None
+            # NOTE: NaN sorts above every number in Polars, so min/max don't bound these rows
+            or stats.nan_count != 0
+            or not isinstance(self.value, int | float)
+        ):
+            return None
+
+        lo, hi, v = stats.min, stats.max, self.value
+        # NOTE: Polars compares integer columns with float values as floats, which rounds beyond 2^53
+        # and can disagree with comparing the exact bounds. Bounds from stats that predate exact
+        # integer bounds were rounded themselves
+        if max(abs(lo), abs(hi)) > _MAX_EXACT_FLOAT_INT:
+            return None
+        match self.op:
+            case FilterOperation.LT:
+                always, never = hi < v, lo >= v
+            case FilterOperation.LE:
+                always, never = hi <= v, lo > v
+            case FilterOperation.GT:
+                always, never = lo > v, hi <= v
+            case FilterOperation.GE:
+                always, never = lo >= v, hi < v
+            case FilterOperation.EQ:
+                always, never = lo == hi == v, v < lo or v > hi
+            case FilterOperation.NE:
+                always, never = v < lo or v > hi, lo == hi == v
+            case _:
+                return None
+
+        if never:
+            return False
+        # NOTE: Comparisons against nulls are never true
+        if always and stats.null_count == 0:
+            return True
+        return None
+
 
 @dataclass
 class AnalysisFilter:
@@ -72,9 +118,16 @@ class AnalysisFilter:
     def default(cls) -> Self:
         return cls([FilterPredicate.default()])
 
-    def apply(self, src_df: pl.DataFrame) -> pl.DataFrame:
+    def apply(self, src_lf: pl.LazyFrame, stats: TableStats | None = None) -> pl.LazyFrame:
         exprs = []
         for pred in self.predicates:
+            # NOTE: Predicates decided by the source stats are pruned from the query plan
+            decided = pred.decide(None if stats is None else stats.get(pred.col.selected))
+            if decided is True:
+                continue
+            if decided is False:
+                return src_lf.clear()
+
             match pred.op:
                 case FilterOperation.LT:
                     expr = pl.col(pred.col.selected).lt(pred.value)
@@ -89,9 +142,11 @@ class AnalysisFilter:
                 case FilterOperation.NE:
                     expr = pl.col(pred.col.selected).ne(pred.value)
             exprs.append(expr)
+        if not exprs:
+            return src_lf
         full_expr = reduce(lambda a, b: a & b, exprs)
         # TODO: if this causes error then send alert to user with "failed operation"
-        result = src_df.filter(full_expr)
+        result = src_lf.filter(full_expr)
         return result
 
 
@@ -109,7 +164,7 @@ class AnalysisCalculate:
             "",
         )
 
-    def apply(self, src_df: pl.DataFrame) -> pl.DataFrame:
+    def apply(self, src_lf: pl.LazyFrame, stats: TableStats | None = None) -> pl.LazyFrame:
         raise NotImplementedError
 
 
@@ -127,7 +182,7 @@ class AnalysisAggregate:
             "",
         )
 
-    def apply(self, src_df: pl.DataFrame) -> pl.DataFrame:
+    def apply(self, src_lf: pl.LazyFrame, stats: TableStats | None = None) -> pl.LazyFrame:
         raise NotImplementedError
 
 
@@ -157,7 +212,7 @@ class AnalysisJoin:
             [],
         )
 
-    def apply(self, src_df: pl.DataFrame) -> pl.DataFrame:
+    def apply(self, src_lf: pl.LazyFrame, stats: TableStats | None = None) -> pl.LazyFrame:
         raise NotImplementedError
 
 
@@ -1,11 +1,43 @@
+import math
+import os
 from dataclasses import dataclass
 from enum import StrEnum, auto, unique
+from pathlib import Path
 from typing import Any, Callable, Self
 
+import numpy as np
+import orjson
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import plotly.offline
 import polars as pl
-import polars.selectors as cs
+
+from app.config import (
+    HEATMAP_CELLS_CACHE_MAX_BYTES,
+    HEATMAP_MAX_CATEGORIES,
+    HISTOGRAM_BIN_COUNT,
+    HISTOGRAM_BIN_RULE,
+    HISTOGRAM_MAX_BINS,
+    SCATTER_DECIMATE_GRID_SIZE,
+    SCATTER_DECIMATE_MIN_ROWS,
+    SCATTER_DECIMATE_TARGET_ROWS,
+    SCATTER_WEBGL_MIN_ROWS,
+)
+from app.dependencies.cache import SizedLRUCache
+from app.dependencies.specs.table import DtypeClass, TableSchema
+
+# NOTE: Versioned filename so browsers can cache the bundle forever
+PLOTLYJS_FILENAME = f"plotly-{plotly.offline.get_plotlyjs_version()}.min.js"
+PLOTLYJS_URL = f"/static/lib/{PLOTLYJS_FILENAME}"
+PLOTLY_CONFIG = {
+    "responsive": True,
+    "displayModeBar": False,
+}
+# NOTE: Points beyond these quantiles on either axis survive decimation
+SCATTER_OUTLIER_QUANTILE = 0.001
+# NOTE: Heatmaps with fewer occupied cells than this fraction only send the occupied cells
+HEATMAP_SPARSE_MAX_FILL = 0.5
 
 
 def fig_layout(fig: go.Figure) -> None:
@@ -25,20 +57,75 @@ def fig_layout(fig: go.Figure) -> None:
     )
 
 
-def fig_html(fig: go.Figure) -> str:
-    chart_html: str = fig.to_html(
-        validate=False,
-        div_id="plotly_generated_div",
-        full_html=False,
-        include_plotlyjs=True,
-        default_height="100%",
-        config={
-            "responsive": True,
-            "displayModeBar": False,
-        },
+def fig_sampling_note(fig: go.Figure, n_shown: int, n_total: int) -> None:
+    fig.add_annotation(
+        text=f"Showing {n_shown:,} of {n_total:,} points ({n_shown / n_total:.1%})",
+        xref="paper",
+        yref="paper",
+        x=1,
+        y=1,
+        xanchor="right",
+        yanchor="top",
+        showarrow=False,
+    )
+
+
+def decimate_scatter(df: pl.DataFrame, x: str, y: str, target_rows: int) -> pl.DataFrame:
+    """Thin out points on a grid so every occupied cell keeps a share proportional to its density.
+
+    Sparse cells always keep at least one point and outliers on either axis are always kept,
+    so the shape of the distribution and its extremes survive.
+    """
+    grid = SCATTER_DECIMATE_GRID_SIZE
+    step = max(1, round(df.height / target_rows))
+
+    def cell(c: str) -> pl.Expr:
+        v = pl.col(c).cast(pl.Float64)
+        scaled = ((v - v.min()) / (v.max() - v.min()) * grid).fill_nan(0)
+        return scaled.floor().clip(0, grid - 1).cast(pl.Int32)
+
+    def is_outlier(c: str) -> pl.Expr:
+        v = pl.col(c)
+        return (v < v.quantile(SCATTER_OUTLIER_QUANTILE)) | (v > v.quantile(1 - SCATTER_OUTLIER_QUANTILE))
+
+    return (
+        df.lazy()
+        .drop_nulls([x, y])
+        .with_columns(_cell_x=cell(x), _cell_y=cell(y))
+        .filter(
+            (pl.int_range(pl.len()).over("_cell_x", "_cell_y") % step == 0)
+            | is_outlier(x)
+            | is_outlier(y),
+        )
+        .drop("_cell_x", "_cell_y")
+        .collect()
     )
-    # Strip stupid wrapper div that messes the height inherit from parent div
-    chart_html = chart_html[5:-6]
+
+
+def write_plotlyjs(static_lib_dir: Path) -> None:
+    # NOTE: Bundle comes from the installed plotly package so it always matches the figure JSON
+    bundle_path = static_lib_dir / PLOTLYJS_FILENAME
+    if not bundle_path.exists():
+        # NOTE: Workers start concurrently, a per-process temp file and an atomic rename mean none
+        # of them can serve (and have browsers cache forever) a half-written bundle
+        tmp_path = bundle_path.with_name(f".{bundle_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(plotly.offline.get_plotlyjs())
+        os.replace(tmp_path, bundle_path)
+
+
+def fig_html(fig: go.Figure) -> str:
+    # NOTE: plotly.js is loaded once by the base page, charts only ship their figure JSON
+    fig_json = pio.to_json(fig, validate=False, engine="orjson")
+    # Stop string values containing "</script>" from closing the script element early
+    fig_json = fig_json.replace("</", "<\\/")
+    config_json = orjson.dumps(PLOTLY_CONFIG).decode()
+    chart_html = f"""<div id="plotly_generated_div" class="plotly-graph-div" style="height:100%; width:100%;"></div>
+<script>
+(() => {{
+  const fig = {fig_json};
+  Plotly.react("plotly_generated_div", fig.data, fig.layout, {config_json});
+}})();
+</script>"""
     return chart_html
 
 
@@ -50,6 +137,121 @@ class ChartKind(StrEnum):
     HISTOGRAM = auto()
 
 
+@unique
+class BinRule(StrEnum):
+    COUNT = auto()
+    WIDTH = auto()
+    STURGES = auto()
+    FREEDMAN_DIACONIS = auto()
+
+
+def histogram_counts(
+    df: pl.DataFrame,
+    x: str,
+    color: str | None,
+    rule: BinRule,
+    bin_count: int,
+    bin_width: float | None,
+) -> tuple[pl.DataFrame, float]:
+    """Bin `x` (per `color` group) in Polars, returning per-bin counts and the bin width."""
+    col = pl.col(x)
+    stats = df.select(
+        lo=col.min(),
+        hi=col.max(),
+        n=col.count(),
+        iqr=col.quantile(0.75) - col.quantile(0.25),
+    ).row(0, named=True)
+    lo, hi, n = stats["lo"] or 0, stats["hi"] or 0, stats["n"]
+    span = hi - lo
+
+    match rule:
+        case BinRule.COUNT:
+            width = span / bin_count
+        case BinRule.WIDTH:
+            width = bin_width or span / bin_count
+        case BinRule.STURGES:
+            width = span / (math.ceil(math.log2(max(n, 1))) + 1)
+        case BinRule.FREEDMAN_DIACONIS:
+            width = 2 * (stats["iqr"] or 0) / max(n, 1) ** (1 / 3)
+            if width == 0:
+                width = span / (math.ceil(math.log2(max(n, 1))) + 1)
+    # NOTE: Constant columns still get a single bin and no rule may produce unbounded bins
+    if width <= 0:
+        width = 1.0
+    width = max(width, span / HISTOGRAM_MAX_BINS)
+    n_bins = max(1, math.ceil(span / width))
+
+    group_cols = ["bin"] if color is None else ["bin", color]
+    counts = (
+        df.lazy()
+        .drop_nulls(x)
+        .with_columns(bin=((col - lo) / width).floor().clip(0, n_bins - 1).cast(pl.Int64))
+        .group_by(group_cols)
+        .agg(count=pl.len())
+        .with_columns(bin_start=lo + pl.col("bin") * width)
+        .with_columns(bin_end=pl.col("bin_start") + width, bin_center=pl.col("bin_start") + width / 2)
+        .sort(group_cols)
+        .collect()
+    )
+    return counts, width
+
+
+@dataclass
+class HeatmapCells:
+    """Aggregated heatmap in sparse form, `x_idx`/`y_idx` index into the sorted axis labels."""
+
+    x_labels: list[Any]
+    y_labels: list[Any]
+    cells: pl.DataFrame
+
+    @property
+    def fill(self) -> float:
+        return self.cells.height / max(1, len(self.x_labels) * len(self.y_labels))
+
+    def dense(self) -> np.ndarray:
+        mat = np.full((len(self.y_labels), len(self.x_labels)), np.nan)
+        mat[self.cells["y_idx"].to_numpy(), self.cells["x_idx"].to_numpy()] = self.cells["z"].to_numpy()
+        return mat
+
+
+# NOTE: Keyed by the source fingerprint and every input of the aggregation, so changing only the
+# presentation of a heatmap (annotation, color scale) reuses the group-by result
+heatmap_cells: SizedLRUCache[HeatmapCells] = SizedLRUCache(
+    HEATMAP_CELLS_CACHE_MAX_BYTES,
+    lambda c: int(c.cells.estimated_size()),
+)
+
+
+def aggregate_heatmap(
+    df: pl.DataFrame,
+    x: str,
+    y: str,
+    z_expr: pl.Expr,
+    max_categories: int,
+) -> HeatmapCells:
+    lf = df.lazy().drop_nulls([x, y])
+    # NOTE: High-cardinality axes are limited to their most frequent categories
+    for c in (x, y):
+        top = lf.group_by(c).agg(pl.len()).top_k(max_categories, by="len").select(c)
+        lf = lf.join(top, on=c, how="semi")
+
+    # NOTE: Dense ranks of the aggregated keys give matrix positions matching the sorted labels
+    cells = (
+        lf.group_by(x, y)
+        .agg(z=z_expr)
+        .with_columns(
+            x_idx=pl.col(x).rank("dense").cast(pl.Int64) - 1,
+            y_idx=pl.col(y).rank("dense").cast(pl.Int64) - 1,
+        )
+        .collect()
+    )
+    return HeatmapCells(
+        x_labels=cells.get_column(x).unique().sort().to_list(),
+        y_labels=cells.get_column(y).unique().sort().to_list(),
+        cells=cells,
+    )
+
+
 @dataclass
 class DimensionValue:
     selected: str
@@ -80,9 +282,9 @@ class ChartScatter:
     symbol: DimensionValue
 
     @classmethod
-    def default(cls, df: pl.DataFrame) -> Self:
-        colnames_num = df.select(cs.numeric()).columns
-        colnames_cat = df.select(cs.string(include_categorical=True)).columns
+    def default(cls, schema: TableSchema) -> Self:
+        colnames_num = schema.names(DtypeClass.NUMERIC)
+        colnames_cat = schema.names(DtypeClass.CATEGORICAL)
         colnames_mix = colnames_num + colnames_cat
         return cls(
             x=DimensionValue.from_list(colnames_num, 0),
@@ -92,16 +294,25 @@ class ChartScatter:
             symbol=DimensionValue.from_list(colnames_mix, None),
         )
 
-    def make_fig(self, df: pl.DataFrame) -> go.Figure:
+    def make_fig(self, df: pl.DataFrame, src_key: str | None = None) -> go.Figure:
+        _x, _y = self.x.current(), self.y.current()
+        assert _x is not None and _y is not None
+        n_total = df.height
+        if n_total > SCATTER_DECIMATE_MIN_ROWS:
+            df = decimate_scatter(df, _x, _y, SCATTER_DECIMATE_TARGET_ROWS)
+
         fig = px.scatter(
             df,
-            x=self.x.current(),
-            y=self.y.current(),
+            x=_x,
+            y=_y,
             color=self.color.current(),
             size=self.size.current(),
             symbol=self.symbol.current(),
+            render_mode="webgl" if n_total > SCATTER_WEBGL_MIN_ROWS else "svg",
         )
         fig_layout(fig)
+        if df.height < n_total:
+            fig_sampling_note(fig, df.height, n_total)
         return fig
 
 
@@ -118,9 +329,9 @@ class ChartBar:
     _agg_func: Callable = pl.len
 
     @classmethod
-    def default(cls, df: pl.DataFrame) -> Self:
-        colnames_num = df.select(cs.numeric()).columns
-        colnames_cat = df.select(cs.string(include_categorical=True)).columns
+    def default(cls, schema: TableSchema) -> Self:
+        colnames_num = schema.names(DtypeClass.NUMERIC)
+        colnames_cat = schema.names(DtypeClass.CATEGORICAL)
         # colnames_mix = colnames_num + colnames_cat
         return cls(
             x=DimensionValue.from_list(colnames_cat, 0),
@@ -128,7 +339,7 @@ class ChartBar:
             color=DimensionValue.from_list(colnames_cat, None),
         )
 
-    def make_fig(self, df: pl.DataFrame) -> go.Figure:
+    def make_fig(self, df: pl.DataFrame, src_key: str | None = None) -> go.Figure:
         gs = [self.x.current()]
         if self.color.current() is not None:
             gs.append(self.color.current())
@@ -149,23 +360,64 @@ class ChartHistogram:
 
     x: DimensionValue
     color: DimensionValue
+    _bin_rule: BinRule = BinRule(HISTOGRAM_BIN_RULE)
+    _bin_count: int = HISTOGRAM_BIN_COUNT
+    _bin_width: float | None = None
 
     @classmethod
-    def default(cls, df: pl.DataFrame) -> Self:
-        colnames_num = df.select(cs.numeric()).columns
-        colnames_cat = df.select(cs.string(include_categorical=True)).columns
+    def default(cls, schema: TableSchema) -> Self:
+        colnames_num = schema.names(DtypeClass.NUMERIC)
+        colnames_cat = schema.names(DtypeClass.CATEGORICAL)
         # colnames_mix = colnames_num + colnames_cat
         return cls(
             x=DimensionValue.from_list(colnames_num, 0),
             color=DimensionValue.from_list(colnames_cat, None),
         )
 
-    def make_fig(self, df: pl.DataFrame) -> go.Figure:
-        # TODO: Incorporate color
-        fig = px.histogram(
+    def bin_rule_options(self) -> list[str]:
+        return [rule.value for rule in BinRule]
+
+    def update_bins(self, name: str, value: str) -> None:
+        """Apply a binning setting from the chart controls, `ValueError` if it is invalid."""
+        match name:
+            case "bin_rule":
+                self._bin_rule = BinRule(value)
+            case "bin_count":
+                bin_count = int(value)
+                if not 1 <= bin_count <= HISTOGRAM_MAX_BINS:
+                    raise ValueError(f"Bin count must be between 1 and {HISTOGRAM_MAX_BINS}")
+                self._bin_count = bin_count
+            case "bin_width":
+                # NOTE: An empty width falls back to the bin count
+                bin_width = float(value) if value else None
+                if bin_width is not None and not (math.isfinite(bin_width) and bin_width > 0):
+                    raise ValueError("Bin width must be a positive number")
+                self._bin_width = bin_width
+            case _:
+                raise ValueError(f"Unknown histogram setting '{name}'")
+
+    def make_fig(self, df: pl.DataFrame, src_key: str | None = None) -> go.Figure:
+        # NOTE: Bins are computed here so the figure only carries one bar per bin (and color)
+        _x = self.x.current()
+        assert _x is not None
+        counts, width = histogram_counts(
             df,
-            x=self.x.current(),
+            _x,
+            self.color.current(),
+            self._bin_rule,
+            self._bin_count,
+            self._bin_width,
+        )
+        fig = px.bar(
+            counts,
+            x="bin_center",
+            y="count",
+            color=self.color.current(),
+            hover_data={"bin_center": False, "bin_start": True, "bin_end": True},
+            labels={"bin_center": _x},
         )
+        fig.update_traces(width=width)
+        fig.update_layout(bargap=0)
         fig_layout(fig)
         return fig
 
@@ -179,11 +431,12 @@ class ChartHeatmap:
     _z: DimensionValue
     _agg_func: Callable = pl.mean
     annotate: bool = False
+    _max_categories: int = HEATMAP_MAX_CATEGORIES
 
     @classmethod
-    def default(cls, df: pl.DataFrame) -> Self:
-        colnames_num = df.select(cs.numeric()).columns
-        colnames_cat = df.select(cs.string(include_categorical=True)).columns
+    def default(cls, schema: TableSchema) -> Self:
+        colnames_num = schema.names(DtypeClass.NUMERIC)
+        colnames_cat = schema.names(DtypeClass.CATEGORICAL)
         # colnames_mix = colnames_num + colnames_cat
         return cls(
             x=DimensionValue.from_list(colnames_cat, 0),
@@ -191,37 +444,52 @@ class ChartHeatmap:
             _z=DimensionValue.from_list(colnames_num, 0),
         )
 
-    def make_fig(self, df: pl.DataFrame) -> go.Figure:
+    def aggregate(self, df: pl.DataFrame, src_key: str | None = None) -> HeatmapCells:
+        _x, _y, _z = self.x.current(), self.y.current(), self._z.current()
+        assert _x is not None and _y is not None and _z is not None
+        key = None
+        if src_key is not None:
+            key = f"{src_key}:{_x}:{_y}:{_z}:{self._agg_func.__name__}:{self._max_categories}"
+            if (cells := heatmap_cells.get(key)) is not None:
+                return cells
+
+        cells = aggregate_heatmap(df, _x, _y, self._agg_func(_z), self._max_categories)
+        if key is not None:
+            heatmap_cells.put(key, cells)
+        return cells
+
+    def make_fig(self, df: pl.DataFrame, src_key: str | None = None) -> go.Figure:
         # TODO: Incorporate color
         # ALSO rename _z to color?
-        _x = self.x.current()
-        assert _x is not None
-        mat = (
-            df.group_by(
-                self.x.current(),
-                self.y.current(),
+        heatmap = self.aggregate(df, src_key)
+        labels = {
+            "x": self.x.current(),
+            "y": self.y.current(),
+            "color": self._z.current(),
+        }
+
+        if heatmap.fill < HEATMAP_SPARSE_MAX_FILL:
+            x_labels = np.asarray(heatmap.x_labels, dtype=object)
+            y_labels = np.asarray(heatmap.y_labels, dtype=object)
+            fig = go.Figure(
+                go.Heatmap(
+                    x=x_labels[heatmap.cells["x_idx"].to_numpy()],
+                    y=y_labels[heatmap.cells["y_idx"].to_numpy()],
+                    z=heatmap.cells["z"].to_numpy(),
+                    colorbar={"title": {"text": labels["color"]}},
+                    texttemplate="%{z}" if self.annotate else None,
+                ),
             )
-            .agg(self._agg_func(self._z.current()))
-            .pivot(
-                on=_x,
-                index=self.y.current(),
-                values=self._z.current(),
+            fig.update_xaxes(title_text=labels["x"], categoryorder="array", categoryarray=heatmap.x_labels)
+            fig.update_yaxes(title_text=labels["y"], categoryorder="array", categoryarray=heatmap.y_labels)
+        else:
+            fig = px.imshow(
+                heatmap.dense(),
+                labels=labels,
+                x=heatmap.x_labels,
+                y=heatmap.y_labels,
+                text_auto=self.annotate,
             )
-            .drop(cs.by_index(0))
-            .to_numpy()
-        )
-
-        fig = px.imshow(
-            mat,
-            labels={
-                "x": self.x.current(),
-                "y": self.y.current(),
-                "color": self._z.current(),
-            },
-            x=df.select(self.x.current()).to_series().unique().to_list(),
-            y=df.select(self.y.current()).to_series().unique().to_list(),
-            text_auto=self.annotate,
-        )
         fig_layout(fig)
         return fig
 
@@ -0,0 +1,31 @@
+import dataclasses
+import hashlib
+from enum import StrEnum
+from typing import Any
+
+import orjson
+
+
+def encode_spec(obj: Any) -> Any:
+    """Convert a node spec into JSON-compatible values, tagging dataclasses and enums by type name."""
+    if isinstance(obj, StrEnum):
+        return {"__enum__": type(obj).__name__, "value": obj.value}
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        # NOTE: Fields with `init=False` are runtime caches and never part of the spec
+        return {
+            "__type__": type(obj).__name__,
+            **{f.name: encode_spec(getattr(obj, f.name)) for f in dataclasses.fields(obj) if f.init},
+        }
+    if isinstance(obj, list):
+        return [encode_spec(v) for v in obj]
+    if callable(obj):
+        # NOTE: Aggregation functions of chart specs, e.g. `pl.len`
+        return {"__polars_fn__": obj.__name__}
+    return obj
+
+
+def spec_digest(obj: Any, *extra: str) -> str:
+    h = hashlib.blake2b(orjson.dumps(encode_spec(obj)), digest_size=16)
+    for e in extra:
+        h.update(e.encode())
+    return h.hexdigest()
@@ -1,14 +1,27 @@
 import uuid
-from dataclasses import asdict, dataclass, field
+from collections import deque
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 from enum import StrEnum, auto
-from typing import Any
+from typing import Any, Self
 
-import networkx as nx
 import polars as pl
 
+from app.config import GRAPH_CHANGELOG_MAX_ENTRIES, MATERIALIZED_CACHE_MAX_BYTES
+from app.dependencies.cache import SizedLRUCache
+from app.dependencies.metrics import Stage, stage_timer
 from app.dependencies.specs.analysis import DataAnalysis, KindAnalysis
 from app.dependencies.specs.chart import ChartKind, DataChart
-from app.dependencies.specs.table import KindTable
+from app.dependencies.specs.encoding import spec_digest
+from app.dependencies.specs.table import (
+    DataTable,
+    DerivedTable,
+    KindTable,
+    StoredTable,
+    TableSchema,
+    TableStats,
+    compute_table_stats,
+)
 
 # add node for table(name: str, kind: KindTable, data: pl.DataFrame) -> UUID
 # add node for analysis(name: str, method: KindAnalysis, data: Analysis) -> UUID
@@ -28,6 +41,13 @@ from app.dependencies.specs.table import KindTable
 # ->> should cascade across ALL children (AND edges)
 
 
+# NOTE: Keyed by content fingerprint so tables whose upstream changed are never hit again
+materialized_tables: SizedLRUCache[pl.DataFrame] = SizedLRUCache(
+    MATERIALIZED_CACHE_MAX_BYTES,
+    lambda df: int(df.estimated_size()),
+)
+
+
 class KindNode(StrEnum):
     TABLE = auto()
     ANALYSIS = auto()
@@ -42,42 +62,159 @@ class GraphNode:
     name: str
     kind: KindNode
     subkind: SubkindNode
-    data: pl.DataFrame | DataAnalysis | DataChart
+    data: DataTable | DataAnalysis | DataChart
 
     def to_json(self) -> dict[str, Any]:
-        d = asdict(self)
-        del d["data"]
-        return d
+        # NOTE: Not `asdict`, it would deep-copy `data` (and any DataFrame in it) only to drop it
+        return {"name": self.name, "kind": self.kind, "subkind": self.subkind}
+
+
+@dataclass(frozen=True)
+class TableSource:
+    """Rows of a table node resolved on the event loop, so pool threads never walk the graph."""
+
+    fingerprint: str
+    plan: pl.LazyFrame
+    table: DataTable
+
+    def collect(self) -> pl.DataFrame:
+        if isinstance(self.table, StoredTable):
+            return self.table.load()
+
+        df = materialized_tables.get(self.fingerprint)
+        if df is None:
+            with stage_timer(Stage.ANALYSIS_APPLY):
+                df = self.plan.collect()
+            materialized_tables.put(self.fingerprint, df)
+            if self.table.cached_stats(self.fingerprint) is None:
+                self.table.cache_stats(self.fingerprint, compute_table_stats(df.lazy()))
+        return df
+
+
+class NodeRecord:
+    """A node of `Graph` together with its adjacency."""
+
+    __slots__ = ("node", "parents", "children")
+
+    def __init__(self, node: GraphNode) -> None:
+        self.node = node
+        # NOTE: Dicts as insertion-ordered sets, so unlinking a neighbour is O(1)
+        self.parents: dict[str, None] = {}
+        self.children: dict[str, None] = {}
 
 
 @dataclass
 class Graph:
-    data: nx.DiGraph = field(default_factory=nx.DiGraph)
+    nodes: dict[str, NodeRecord] = field(default_factory=dict)
+    # NOTE: Bumped on every mutation, used to find graphs that need to be written back to the DB
+    version: int = 0
+    # NOTE: Secondary indexes maintained on every insert and delete, values are ordered id sets
+    _by_kind: dict[KindNode, dict[str, None]] = field(default_factory=dict, init=False, repr=False)
+    _by_subkind: dict[tuple[KindNode, SubkindNode], dict[str, None]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # NOTE: `(version, change)` of recent cytoscape element changes, complete from `_changes_floor` on
+    _changes: deque[tuple[int, dict[str, Any]]] = field(default_factory=deque, init=False, repr=False)
+    _changes_floor: int = field(default=0, init=False, repr=False)
+    # NOTE: Table store files removed from the graph, by the version that removed them. The persisted
+    # graph keeps referencing them until a snapshot at least that new is written
+    _dropped_tables: dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    # NOTE: Table store files added since the last persisted snapshot, nothing else references them
+    _added_tables: dict[str, int] = field(default_factory=dict, init=False, repr=False)
 
     def __repr__(self) -> str:
         nodes_info = [
-            f"{node}:{data['data'].kind}:{data['data'].subkind}"
-            for node, data in self.data.nodes(data=True)
+            f"{node_id}:{rec.node.kind}:{rec.node.subkind}" for node_id, rec in self.nodes.items()
         ]
         return f"{self.__class__.__name__}(" + ", ".join(nodes_info) + ")"
 
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        legacy = state.pop("data", None)
+        if legacy is None:
+            self.__dict__.update(state)
+            return
+        # NOTE: Pickles written before this store existed hold a networkx DiGraph in `data`,
+        # networkx is only still needed to unpickle those
+        nodes = [(node_id, attrs["data"]) for node_id, attrs in legacy.nodes(data=True)]
+        self.__dict__.update(Graph.restore(state.get("version", 0), nodes, legacy.edges()).__dict__)
+
+    @classmethod
+    def restore(
+        cls,
+        version: int,
+        nodes: Iterable[tuple[str, GraphNode]],
+        edges: Iterable[tuple[str, str]],
+    ) -> Self:
+        """Rebuild a persisted graph at `version`, its tables are already referenced by that snapshot."""
+        # NOTE: Not through `add_node`/`add_edge`, they bump the version, record a change per element
+        # and track every table as unpersisted
+        graph = cls()
+        for node_id, node in nodes:
+            graph.nodes[node_id] = NodeRecord(node)
+            graph._by_kind.setdefault(node.kind, {})[node_id] = None
+            graph._by_subkind.setdefault((node.kind, node.subkind), {})[node_id] = None
+        for src, dst in edges:
+            graph.nodes[src].children[dst] = None
+            graph.nodes[dst].parents[src] = None
+        graph.reset_changes(version)
+        return graph
+
+    def edges(self) -> list[tuple[str, str]]:
+        return [(src, dst) for src, rec in self.nodes.items() for dst in rec.children]
+
     def to_json(self) -> tuple[list[dict[str, Any]], list[dict[str, str]]]:
         nodes = [
             {
-                "id": node,
-                **data["data"].to_json(),
+                "id": node_id,
+                **rec.node.to_json(),
             }
-            for node, data in self.data.nodes(data=True)
+            for node_id, rec in self.nodes.items()
         ]
         edges = [
             {
                 "source": src,
                 "target": dst,
             }
-            for src, dst in self.data.edges()
+            for src, dst in self.edges()
         ]
         return nodes, edges
 
+    def to_client(self) -> dict[str, Any]:
+        """Full graph for the client, which asks for changes since `version` afterwards."""
+        return {"version": self.version, "elements": self.to_cytoscape()}
+
+    def changes_since(self, since: int) -> list[dict[str, Any]] | None:
+        """Element changes to apply in order after `since`, `None` once they are no longer known."""
+        if not self._changes_floor <= since <= self.version:
+            return None
+        return [change for version, change in self._changes if version > since]
+
+    def reset_changes(self, version: int) -> None:
+        """Start an empty changelog at `version`, clients on older versions get the full graph."""
+        self.version = version
+        self._changes.clear()
+        self._changes_floor = version
+
+    def mark_persisted(self, version: int) -> list[str]:
+        """Ids of dropped tables the graph persisted at `version` no longer references."""
+        self._added_tables = {t: v for t, v in self._added_tables.items() if v > version}
+        released = [t for t, dropped_at in self._dropped_tables.items() if dropped_at <= version]
+        for table_id in released:
+            del self._dropped_tables[table_id]
+        return released
+
+    def unpersisted_tables(self) -> list[str]:
+        """Ids of tables added since the last persisted snapshot, orphaned if this graph is discarded."""
+        return list(self._added_tables)
+
+    def _record(self, change: dict[str, Any]) -> None:
+        self._changes.append((self.version, change))
+        if len(self._changes) > GRAPH_CHANGELOG_MAX_ENTRIES:
+            self._changes_floor = self._changes.popleft()[0]
+
     def to_cytoscape(self) -> dict[str, list[dict[str, Any]]]:
         nodes, edges = self.to_json()
         d = {
@@ -90,30 +227,95 @@ class Graph:
         }
         return d
 
-    def add_node(self, new_node: GraphNode) -> str:
-        new_node_id = str(uuid.uuid4())
-        self.data.add_node(new_node_id, data=new_node)
+    def add_node(self, new_node: GraphNode, node_id: str | None = None) -> str:
+        new_node_id = node_id or str(uuid.uuid4())
+        self.nodes[new_node_id] = NodeRecord(new_node)
+        self._by_kind.setdefault(new_node.kind, {})[new_node_id] = None
+        self._by_subkind.setdefault((new_node.kind, new_node.subkind), {})[new_node_id] = None
+        self.touch()
+        if isinstance(new_node.data, StoredTable):
+            self._added_tables[new_node.data.table_id] = self.version
+        self._record({"op": "add", "group": "nodes", "data": {"id": new_node_id, **new_node.to_json()}})
         return new_node_id
 
     def add_edge(self, src: str, dst: str) -> None:
-        self.data.add_edge(src, dst)
+        self.nodes[src].children[dst] = None
+        self.nodes[dst].parents[src] = None
+        self.touch()
+        self._record({"op": "add", "group": "edges", "data": {"source": src, "target": dst}})
+
+    def touch(self) -> None:
+        # NOTE: Must be called after mutating the spec of an existing node in-place
+        self.version += 1
 
     def get_node_data(self, node_id: str) -> GraphNode:
-        return self.data.nodes[node_id]["data"]
+        return self.nodes[node_id].node
+
+    def fingerprint(self, node_id: str, memo: dict[str, str] | None = None) -> str:
+        """Content hash of the spec of a node and all of its ancestors."""
+        if memo is not None and node_id in memo:
+            return memo[node_id]
+        rec = self.nodes[node_id]
+        parents = sorted(self.fingerprint(p_id, memo) for p_id in rec.parents)
+        digest = spec_digest(rec.node.data, *parents)
+        if memo is not None:
+            memo[node_id] = digest
+        return digest
+
+    def lazy_table(self, node_id: str) -> pl.LazyFrame:
+        """Query plan for the rows of a table node, chaining every upstream analysis."""
+        node_data = self.get_node_data(node_id).data
+        if isinstance(node_data, StoredTable):
+            return node_data.scan()
+
+        # NOTE: calculated-table <- analysis <- source table
+        assert isinstance(node_data, DerivedTable)
+        ((analysis_id, analysis_node),) = self.get_parents(node_id)
+        src_id, _ = self.get_parents(analysis_id)[0]
+        assert isinstance(analysis_node.data, DataAnalysis)
+        return analysis_node.data.apply(self.lazy_table(src_id), self._known_stats(src_id))
+
+    def table_source(self, node_id: str) -> TableSource:
+        node_data = self.get_node_data(node_id).data
+        assert isinstance(node_data, (StoredTable, DerivedTable))
+        return TableSource(self.fingerprint(node_id), self.lazy_table(node_id), node_data)
+
+    def get_table(self, node_id: str) -> pl.DataFrame:
+        return self.table_source(node_id).collect()
+
+    def _known_stats(self, node_id: str) -> TableStats | None:
+        # NOTE: Never computes anything, used to prune query plans when stats happen to be available
+        node_data = self.get_node_data(node_id).data
+        if isinstance(node_data, StoredTable):
+            return node_data.stats
+        assert isinstance(node_data, DerivedTable)
+        return node_data.cached_stats(self.fingerprint(node_id))
+
+    def get_table_schema(self, node_id: str) -> TableSchema:
+        # NOTE: Resolving the plan's schema reads no rows, full stats are only computed when the
+        # rows are materialized in the compute pool
+        return TableSchema.from_polars(self.lazy_table(node_id).collect_schema())
 
     def get_parents(self, node_id: str) -> list[tuple[str, GraphNode]]:
-        return [(p_id, self.data.nodes[p_id]["data"]) for p_id in self.data.predecessors(node_id)]
+        return [(p_id, self.nodes[p_id].node) for p_id in self.nodes[node_id].parents]
 
     def get_nodes_by_kind(
         self,
         kind: KindNode,
         subkind: SubkindNode | None = None,
     ) -> list[tuple[str, GraphNode]]:
-        table_nodes = []
-        for node, data in self.data.nodes(data=True):
-            if (data["data"].kind == kind) and (subkind is None or data["data"].subkind == subkind):
-                table_nodes.append((node, data["data"]))
-        return table_nodes
+        if subkind is None:
+            node_ids = self._by_kind.get(kind, {})
+        else:
+            node_ids = self._by_subkind.get((kind, subkind), {})
+        return [(node_id, self.nodes[node_id].node) for node_id in node_ids]
+
+    def resident_bytes(self) -> int:
+        return sum(
+            node.data.resident_bytes()
+            for _, node in self.get_nodes_by_kind(KindNode.TABLE)
+            if isinstance(node.data, StoredTable)
+        )
 
     def delete_cascade(self, node_id: str) -> int:
         # NOTE: if node is calculated-table then start cascade from it's parent anlaysis node
@@ -125,11 +327,37 @@ class Graph:
         else:
             start = node_id
 
-        working_list = [start]
-        c = 0
-        while len(working_list):
-            curr = working_list.pop(0)
-            working_list.extend(self.data.successors(curr))
-            self.data.remove_node(curr)
-            c += 1
-        return c
+        # NOTE: Breadth-first over a DAG, a join result is reachable from both of its sources
+        subtree = {start: None}
+        queue = deque([start])
+        while queue:
+            for child in self.nodes[queue.popleft()].children:
+                if child not in subtree:
+                    subtree[child] = None
+                    queue.append(child)
+
+        # NOTE: Fingerprints need the ancestors, so they are all taken before anything is removed
+        memo: dict[str, str] = {}
+        for n in subtree:
+            if isinstance(self.get_node_data(n).data, DerivedTable):
+                materialized_tables.pop(self.fingerprint(n, memo))
+
+        dropped = []
+        for n in subtree:
+            rec = self.nodes.pop(n)
+            for p_id in rec.parents:
+                if p_id not in subtree:
+                    self.nodes[p_id].children.pop(n)
+            del self._by_kind[rec.node.kind][n]
+            del self._by_subkind[rec.node.kind, rec.node.subkind][n]
+            if isinstance(rec.node.data, StoredTable):
+                rec.node.data.release()
+                dropped.append(rec.node.data.table_id)
+        self.touch()
+        # NOTE: Files are deleted by the state manager once a snapshot without them is persisted
+        for table_id in dropped:
+            self._dropped_tables[table_id] = self.version
+        # NOTE: Removing a node on the client also removes its edges
+        for n in subtree:
+            self._record({"op": "remove", "id": n})
+        return len(subtree)
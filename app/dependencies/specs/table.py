@@ -1,6 +1,187 @@
+from dataclasses import dataclass, field
 from enum import StrEnum, auto
+from typing import Any, Self
+
+import polars as pl
+
+from app.db.table_store import table_store
 
 
 class KindTable(StrEnum):
     UPLOADED = auto()
     CALCULATED = auto()
+
+
+class DtypeClass(StrEnum):
+    NUMERIC = auto()
+    CATEGORICAL = auto()
+    TEMPORAL = auto()
+    BOOLEAN = auto()
+    OTHER = auto()
+
+    @classmethod
+    def from_dtype(cls, dtype: pl.DataType) -> Self:
+        if dtype.is_numeric():
+            return cls.NUMERIC
+        # NOTE: Same columns as `cs.string(include_categorical=True)`
+        if dtype == pl.String or isinstance(dtype, pl.Categorical):
+            return cls.CATEGORICAL
+        if dtype.is_temporal():
+            return cls.TEMPORAL
+        if dtype == pl.Boolean:
+            return cls.BOOLEAN
+        return cls.OTHER
+
+
+@dataclass
+class ColumnStats:
+    name: str
+    dtype: str
+    dtype_class: DtypeClass
+    null_count: int
+    approx_n_unique: int
+    # NOTE: Only tracked for numeric (as int or float) and categorical (as string) columns
+    min: Any = None
+    max: Any = None
+    is_sorted: bool = False
+    # NOTE: `min`/`max` skip NaN but comparisons don't, `None` means stats predate this field
+    nan_count: int | None = None
+
+
+@dataclass
+class TableSchema:
+    """Column names and dtype classes of a table, resolved from its query plan without reading rows."""
+
+    columns: dict[str, DtypeClass]
+
+    @classmethod
+    def from_polars(cls, schema: pl.Schema) -> Self:
+        return cls({name: DtypeClass.from_dtype(dtype) for name, dtype in schema.items()})
+
+    def names(self, *dtype_classes: DtypeClass) -> list[str]:
+        return [name for name, c in self.columns.items() if not dtype_classes or c in dtype_classes]
+
+
+@dataclass
+class TableStats:
+    """Column catalog of a table, computed once with its rows and used to prune query plans."""
+
+    n_rows: int
+    columns: list[ColumnStats]
+
+    def names(self, *dtype_classes: DtypeClass) -> list[str]:
+        return [c.name for c in self.columns if not dtype_classes or c.dtype_class in dtype_classes]
+
+    def get(self, name: str) -> ColumnStats | None:
+        return next((c for c in self.columns if c.name == name), None)
+
+    def schema(self) -> TableSchema:
+        return TableSchema({c.name: c.dtype_class for c in self.columns})
+
+
+def compute_table_stats(lf: pl.LazyFrame) -> TableStats:
+    schema = lf.collect_schema()
+    dtype_classes = [DtypeClass.from_dtype(dtype) for dtype in schema.dtypes()]
+
+    # NOTE: Every statistic of every column comes out of a single query
+    exprs = [pl.len().alias("n_rows")]
+    for i, (name, dtype, dtype_class) in enumerate(zip(schema.names(), schema.dtypes(), dtype_classes)):
+        col = pl.col(name)
+        exprs += [col.null_count().alias(f"{i}_nulls"), col.approx_n_unique().alias(f"{i}_card")]
+        if dtype_class in (DtypeClass.NUMERIC, DtypeClass.CATEGORICAL):
+            # NOTE: Integers keep their dtype, as Float64 bounds beyond 2^53 would be rounded
+            if dtype.is_integer():
+                v = col
+            else:
+                v = col.cast(pl.Float64 if dtype_class == DtypeClass.NUMERIC else pl.String)
+            exprs += [
+                v.min().alias(f"{i}_min"),
+                v.max().alias(f"{i}_max"),
+                (v >= v.shift(1)).all().alias(f"{i}_sorted"),
+            ]
+        if dtype.is_float():
+            exprs.append(col.is_nan().sum().alias(f"{i}_nans"))
+    row = lf.select(exprs).collect().row(0, named=True)
+
+    return TableStats(
+        n_rows=row["n_rows"],
+        columns=[
+            ColumnStats(
+                name=name,
+                dtype=str(dtype),
+                dtype_class=dtype_class,
+                null_count=row[f"{i}_nulls"],
+                approx_n_unique=row[f"{i}_card"],
+                min=row.get(f"{i}_min"),
+                max=row.get(f"{i}_max"),
+                is_sorted=bool(row.get(f"{i}_sorted", False)),
+                nan_count=row.get(f"{i}_nans", 0),
+            )
+            for i, (name, dtype, dtype_class) in enumerate(
+                zip(schema.names(), schema.dtypes(), dtype_classes),
+            )
+        ],
+    )
+
+
+@dataclass
+class StoredTable:
+    """Reference to a table in the on-disk table store, memory-mapped on first access."""
+
+    table_id: str
+    stats: TableStats | None = None
+    _df: pl.DataFrame | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_df(cls, df: pl.DataFrame) -> Self:
+        return cls(table_store.write(df), compute_table_stats(df.lazy()))
+
+    @classmethod
+    def from_store(cls, table_id: str) -> Self:
+        return cls(table_id, compute_table_stats(table_store.scan(table_id)))
+
+    def load(self) -> pl.DataFrame:
+        if self._df is None:
+            self._df = table_store.read(self.table_id)
+        return self._df
+
+    def scan(self) -> pl.LazyFrame:
+        return table_store.scan(self.table_id)
+
+    def resident_bytes(self) -> int:
+        return 0 if self._df is None else int(self._df.estimated_size())
+
+    def release(self) -> None:
+        self._df = None
+
+    def drop(self) -> None:
+        self.release()
+        table_store.delete(self.table_id)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # NOTE: Only the reference is pickled, the rows stay in the table store
+        return {"table_id": self.table_id, "stats": self.stats}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.table_id = state["table_id"]
+        self.stats = state.get("stats")
+        self._df = None
+
+
+@dataclass
+class DerivedTable:
+    """Calculated table whose rows are produced on demand by its parent analysis node."""
+
+    # NOTE: Stats are only valid for the upstream fingerprint they were computed at
+    _stats: tuple[str, TableStats] | None = field(default=None, init=False, repr=False, compare=False)
+
+    def cached_stats(self, fingerprint: str) -> TableStats | None:
+        if self._stats is None or self._stats[0] != fingerprint:
+            return None
+        return self._stats[1]
+
+    def cache_stats(self, fingerprint: str, stats: TableStats) -> None:
+        self._stats = (fingerprint, stats)
+
+
+DataTable = StoredTable | DerivedTable
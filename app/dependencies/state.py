@@ -1,49 +1,278 @@
-import pickle
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
 
+import polars as pl
 import sqlalchemy as sa
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import (
+    SESSION_IDLE_TTL_SECONDS,
+    SESSION_MAX_RESIDENT_BYTES,
+    SESSION_MIN_RESIDENT_SECONDS,
+    STATE_BACKEND,
+)
 from app.db.models import UserData
-from app.dependencies.specs.graph import Graph
+from app.db.session import get_db_context
+from app.db.table_store import table_store
+from app.dependencies.metrics import Stage, stage_timer
+from app.dependencies.serialization import dump_graph, load_graph
+from app.dependencies.specs.graph import Graph, KindNode
+from app.dependencies.specs.table import StoredTable
+from app.middlewares.custom_logging import logger
+
+# NOTE: Keeps each multi-row upsert well below SQLite's bound parameter limit
+UPSERT_BATCH_SIZE = 500
+
+# (user_id, graph version, serialized graph)
+GraphSnapshot = tuple[str, int, bytes]
 
 
 class StateManager:
-    def __init__(self) -> None:
-        """Singleton state manager based on UUID user_id."""
-        self._user_sessions: dict[str, Graph] = {}
-
-    def get_user_graph(self, user_id: str, db: Session) -> Graph:
-        if user_id not in self._user_sessions:
-            self._user_sessions[user_id] = self._load_graph_from_db(user_id, db)
-        return self._user_sessions[user_id]
-
-    def _load_graph_from_db(self, user_id: str, db: Session) -> Graph:
-        try:
-            user_data = db.query(UserData).filter_by(user_id=user_id).one()
-            # TODO: kill old state based on updated_at field
-            # if user_data.updated_at > 2min:
-            #     graph = Graph()
-        except sa.exc.NoResultFound:
-            graph = Graph()
+    def __init__(self, max_resident_bytes: int, idle_ttl_seconds: float) -> None:
+        """Singleton state manager based on UUID user_id.
+
+        Resident graphs are kept in LRU order and written back to the DB when they sit idle
+        for longer than `idle_ttl_seconds` or when their tables exceed `max_resident_bytes`.
+        A DB session is only opened on a miss or when something has to be written.
+        """
+        self._user_sessions: OrderedDict[str, Graph] = OrderedDict()
+        self._last_access: dict[str, float] = {}
+        self._resident_bytes: dict[str, int] = {}
+        self._persisted_versions: dict[str, int] = {}
+        self._loading: dict[str, asyncio.Task[tuple[Graph, int]]] = {}
+        self._max_resident_bytes = max_resident_bytes
+        self._idle_ttl_seconds = idle_ttl_seconds
+
+    async def get_user_graph(self, user_id: str) -> Graph:
+        if user_id in self._user_sessions:
+            self._user_sessions.move_to_end(user_id)
         else:
-            graph = pickle.loads(user_data.graph_blob)
+            # NOTE: Concurrent first requests of one user must share a single graph object
+            loading = self._loading.get(user_id)
+            if loading is None:
+                loading = asyncio.create_task(self._load_graph_from_db(user_id))
+                self._loading[user_id] = loading
+            try:
+                graph, stored_version = await loading
+            finally:
+                self._loading.pop(user_id, None)
+            if user_id not in self._user_sessions:
+                self._user_sessions[user_id] = graph
+                self._persisted_versions[user_id] = stored_version
+        graph = self._user_sessions[user_id]
+        self._last_access[user_id] = time.monotonic()
+        # NOTE: Picks up tables memory-mapped by this user's previous requests
+        self._resident_bytes[user_id] = graph.resident_bytes()
+        await self._evict()
         return graph
 
+    async def _load_graph_from_db(self, user_id: str) -> tuple[Graph, int]:
+        with stage_timer(Stage.DB_LOAD):
+            async with get_db_context() as db:
+                user_data = await db.get(UserData, user_id)
+        # TODO: kill old state based on updated_at field
+        # if user_data.updated_at > 2min:
+        #     graph = Graph()
+        if user_data is None:
+            return Graph(), 0
+        graph = load_graph(user_data.graph_blob)
+        self._move_legacy_tables_to_store(graph)
+        return graph, user_data.version
+
+    def _move_legacy_tables_to_store(self, graph: Graph) -> None:
+        # NOTE: Blobs written before the table store existed hold the DataFrames inline
+        for _, node in graph.get_nodes_by_kind(KindNode.TABLE):
+            if isinstance(node.data, pl.DataFrame):
+                node.data = StoredTable.from_df(node.data)
+
     def _update_user_graph(self, user_id: str, graph: Graph) -> None:
         self._user_sessions[user_id] = graph
+        self._last_access[user_id] = time.monotonic()
+        self._persisted_versions.pop(user_id, None)
+
+    def resident_users(self) -> int:
+        return len(self._user_sessions)
+
+    def total_resident_bytes(self) -> int:
+        return sum(self._resident_bytes.values())
+
+    def is_dirty(self, user_id: str) -> bool:
+        return self._user_sessions[user_id].version != self._persisted_versions.get(user_id)
+
+    def _forget(self, user_id: str) -> None:
+        del self._user_sessions[user_id]
+        del self._last_access[user_id]
+        self._resident_bytes.pop(user_id, None)
+        self._persisted_versions.pop(user_id, None)
+
+    async def _evict(self) -> None:
+        now = time.monotonic()
+        evicted = []
+        resident_bytes = self.total_resident_bytes()
+        # NOTE: `_user_sessions` is in LRU order so the idlest users come first
+        for user_id in self._user_sessions:
+            idle_for = now - self._last_access[user_id]
+            if idle_for < SESSION_MIN_RESIDENT_SECONDS:
+                break
+            over_budget = resident_bytes > self._max_resident_bytes
+            if not (over_budget or idle_for > self._idle_ttl_seconds):
+                break
+            resident_bytes -= self._resident_bytes.get(user_id, 0)
+            evicted.append((user_id, self._last_access[user_id]))
+        if not evicted:
+            return
+
+        snapshots = [self._snapshot(user_id) for user_id, _ in evicted if self.is_dirty(user_id)]
+        if snapshots:
+            # NOTE: Written before the users are forgotten so their persisted versions are still known
+            await self.write_snapshots(snapshots)
+        n_evicted = 0
+        for user_id, last_access in evicted:
+            # NOTE: A user that came back while the snapshots were written stays resident
+            if self._last_access.get(user_id) == last_access:
+                self._forget(user_id)
+                n_evicted += 1
+        logger.info("Evicted %s idle user sessions", n_evicted)
+
+    def _snapshot(self, user_id: str) -> GraphSnapshot:
+        graph = self._user_sessions[user_id]
+        return user_id, graph.version, dump_graph(graph)
+
+    def snapshot_dirty(self) -> list[GraphSnapshot]:
+        # NOTE: Must run on the event loop thread so no route mutates a graph while it's serialized
+        return [self._snapshot(user_id) for user_id in self._user_sessions if self.is_dirty(user_id)]
+
+    async def write_snapshots(self, snapshots: Iterable[GraphSnapshot]) -> None:
+        """Upsert all snapshots in a single transaction and mark them as persisted."""
+        snapshots = list(snapshots)
+        with stage_timer(Stage.DB_PERSIST):
+            await self._upsert(snapshots)
+
+        for user_id, version, _ in snapshots:
+            # NOTE: Evicted users are already gone and must not be tracked again
+            if user_id in self._user_sessions:
+                self._persisted_versions[user_id] = version
+                self._delete_tables(self._user_sessions[user_id].mark_persisted(version))
+
+    def _delete_tables(self, table_ids: Iterable[str]) -> None:
+        for table_id in table_ids:
+            logger.debug("Deleting table %s from the table store", table_id)
+            table_store.delete(table_id)
+
+    async def _upsert(self, snapshots: list[GraphSnapshot]) -> None:
+        async with get_db_context() as db:
+            for i in range(0, len(snapshots), UPSERT_BATCH_SIZE):
+                batch = snapshots[i : i + UPSERT_BATCH_SIZE]
+                stmt = insert(UserData).values(
+                    [
+                        {"user_id": user_id, "graph_blob": blob, "version": version}
+                        for user_id, version, blob in batch
+                    ],
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[UserData.user_id],
+                    set_={"graph_blob": stmt.excluded.graph_blob, "version": stmt.excluded.version},
+                )
+                await db.execute(stmt)
+            await db.commit()
+
+    async def checkpoint(self) -> int:
+        snapshots = self.snapshot_dirty()
+        if snapshots:
+            await self.write_snapshots(snapshots)
+        return len(snapshots)
+
+    async def commit_user_graph(self, user_id: str) -> None:
+        """Called at the end of every request, changes are left to the periodic checkpoint."""
+
+
+class SharedStateManager(StateManager):
+    """State manager for several workers or replicas sharing one SQLite database.
+
+    Resident graphs are only a read cache here: each request checks the user's stored version
+    and reloads the graph if another process changed it, and each change is written through
+    with a compare-and-swap on that version so concurrent writers can't silently overwrite each other.
+    """
+
+    async def get_user_graph(self, user_id: str) -> Graph:
+        if user_id in self._user_sessions:
+            stmt = sa.select(UserData.version).where(UserData.user_id == user_id)
+            async with get_db_context() as db:
+                stored_version = (await db.execute(stmt)).scalar_one_or_none()
+            resident = user_id in self._user_sessions
+            if resident and stored_version not in (None, self._persisted_versions.get(user_id)):
+                logger.debug("Reloading graph of user %s changed by another worker", user_id)
+                self._forget(user_id)
+        return await super().get_user_graph(user_id)
+
+    async def commit_user_graph(self, user_id: str) -> None:
+        if user_id not in self._user_sessions or not self.is_dirty(user_id):
+            return
+        if not await self._compare_and_swap(self._snapshot(user_id)):
+            if user_id in self._user_sessions:
+                self._discard(user_id)
+            raise HTTPException(
+                status.HTTP_409_CONFLICT,
+                "Your data was changed by another request, reload the page and try again",
+            )
+
+    async def write_snapshots(self, snapshots: Iterable[GraphSnapshot]) -> None:
+        # NOTE: Evictions and checkpoints must not overwrite a newer graph written by another worker
+        for snapshot in snapshots:
+            user_id = snapshot[0]
+            if not await self._compare_and_swap(snapshot) and user_id in self._user_sessions:
+                logger.warning("Dropping stale graph of user %s, it was changed by another worker", user_id)
+                self._discard(user_id)
 
-    def persist_all_to_db(self, db: Session) -> None:
-        for user_id, graph in self._user_sessions.items():
-            graph_blob = pickle.dumps(graph)
-            existing_data = db.query(UserData).filter_by(user_id=user_id).first()
+    def _discard(self, user_id: str) -> None:
+        # NOTE: Tables this graph dropped stay, the winning graph in the DB may still reference them.
+        # Tables it added were never persisted, nothing else will ever reference them
+        self._delete_tables(self._user_sessions[user_id].unpersisted_tables())
+        self._forget(user_id)
 
-            if existing_data:
-                existing_data.graph_blob = graph_blob
-            else:
-                new_data = UserData(user_id=user_id, graph_blob=graph_blob)
-                db.add(new_data)
+    async def _compare_and_swap(self, snapshot: GraphSnapshot) -> bool:
+        user_id, version, blob = snapshot
+        expected = self._persisted_versions.get(user_id, 0)
+        with stage_timer(Stage.DB_PERSIST):
+            async with get_db_context() as db:
+                swapped = await self._update_if_version(db, user_id, expected, version, blob)
+                await db.commit()
+        if swapped and user_id in self._user_sessions:
+            self._persisted_versions[user_id] = version
+            self._delete_tables(self._user_sessions[user_id].mark_persisted(version))
+        return swapped
 
-        db.commit()
+    async def _update_if_version(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        expected: int,
+        version: int,
+        blob: bytes,
+    ) -> bool:
+        result = await db.execute(
+            sa.update(UserData)
+            .where(UserData.user_id == user_id, UserData.version == expected)
+            .values(graph_blob=blob, version=version),
+        )
+        if result.rowcount == 0:
+            # NOTE: Either a brand new user or a lost race, the insert tells the two apart
+            result = await db.execute(
+                insert(UserData)
+                .values(user_id=user_id, graph_blob=blob, version=version)
+                .on_conflict_do_nothing(index_elements=[UserData.user_id]),
+            )
+        return result.rowcount == 1
 
 
-app_state = StateManager()
+match STATE_BACKEND:
+    case "local":
+        app_state = StateManager(SESSION_MAX_RESIDENT_BYTES, SESSION_IDLE_TTL_SECONDS)
+    case "shared":
+        app_state = SharedStateManager(SESSION_MAX_RESIDENT_BYTES, SESSION_IDLE_TTL_SECONDS)
+    case _:
+        raise ValueError(f"Unknown state backend '{STATE_BACKEND}', expected 'local' or 'shared'")
@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import os
+from fnmatch import fnmatch
+from functools import lru_cache
+from mimetypes import guess_type
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import PathLike, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = Path("app/static")
+STATIC_URL_PREFIX = "/static"
+
+# NOTE: Only files whose name or URL changes with their content may be cached forever
+IMMUTABLE_PATTERNS = ["*/lib/plotly-*.min.js"]
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# NOTE: Unversioned URLs must be revalidated, the ETag keeps that to a 304
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".svg", ".json", ".html", ".txt"}
+PRECOMPRESS_MIN_BYTES = 1024
+# NOTE: Most preferred first, each with the suffix of its prebuilt variant
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+@lru_cache(maxsize=256)
+def asset_version(path: str) -> str:
+    """Short content hash of a static file, computed once per process."""
+    return hashlib.blake2b((STATIC_DIR / path).read_bytes(), digest_size=8).hexdigest()
+
+
+def static_url(path: str) -> str:
+    # NOTE: The `v` query parameter changes with the content so the response can be cached forever
+    return f"{STATIC_URL_PREFIX}/{path}?v={asset_version(path)}"
+
+
+def precompress_static(static_dir: Path) -> int:
+    """Write `.gz` (and `.br` when brotli is installed) next to every compressible static file."""
+    compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+
+    n_written = 0
+    for path in static_dir.rglob("*"):
+        if path.suffix not in COMPRESSIBLE_SUFFIXES or path.stat().st_size < PRECOMPRESS_MIN_BYTES:
+            continue
+        for suffix, compress in compressors.items():
+            variant = path.with_name(path.name + suffix)
+            if variant.exists() and variant.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            # NOTE: Workers precompress concurrently, so each writes its own temp file and renames it
+            # into place rather than risk serving a truncated variant
+            tmp_path = variant.with_name(f".{variant.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(compress(path.read_bytes()))
+            os.replace(tmp_path, variant)
+            n_written += 1
+    return n_written
+
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path: PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        accepted = Headers(scope=scope).get("accept-encoding", "")
+        response = None
+        for encoding, suffix in ENCODINGS:
+            variant = Path(full_path).with_name(Path(full_path).name + suffix)
+            if encoding in accepted and variant.is_file():
+                response = super().file_response(variant, variant.stat(), scope, status_code)
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Content-Type"] = media_type
+                break
+        if response is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+
+        if Path(full_path).suffix in COMPRESSIBLE_SUFFIXES:
+            response.headers["Vary"] = "Accept-Encoding"
+        versioned = "v" in parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if versioned or any(fnmatch(str(full_path), pattern) for pattern in IMMUTABLE_PATTERNS):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return response
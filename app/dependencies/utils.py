@@ -1,32 +1,129 @@
+import asyncio
+import hashlib
+import html
 import uuid
 from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from enum import StrEnum
-from typing import Annotated
+from typing import Annotated, TypeVar
+from urllib.parse import urlencode
 
 import polars as pl
-from fastapi import Depends, FastAPI, Request, Response
+from fastapi import Depends, FastAPI, Request, Response, status
 
-from app.db.session import create_db_and_tables, get_db_context
+from app.config import CHECKPOINT_INTERVAL_SECONDS, PREVIEW_SORT_CACHE_MAX_BYTES
+from app.db.session import create_db_and_tables, engine
+from app.dependencies.cache import SizedLRUCache
+from app.dependencies.chart_cache import chart_cache
+from app.dependencies.compute import compute_pool
+from app.dependencies.specs.chart import write_plotlyjs
+from app.dependencies.specs.graph import Graph, TableSource
 from app.dependencies.state import app_state
+from app.dependencies.static_files import STATIC_DIR, precompress_static
+from app.templates.renderer import precompile_templates, templates_version
 from app.middlewares.custom_logging import logger
 
 
+ResponseT = TypeVar("ResponseT", bound=Response)
+
+
 class Theme(StrEnum):
     DARK = "mocha"
     LIGHT = "latte"
 
 
-def make_table_html(df: pl.DataFrame, html_id: str) -> str:
+# NOTE: Row order of a sorted preview, so every later page is a gather of `limit` rows
+preview_sort_index: SizedLRUCache[pl.Series] = SizedLRUCache(
+    PREVIEW_SORT_CACHE_MAX_BYTES,
+    lambda s: int(s.estimated_size()),
+)
+
+
+def get_preview_page(
+    source: TableSource,
+    offset: int,
+    limit: int,
+    sort_by: str | None,
+    descending: bool,
+    columns: list[str] | None,
+) -> tuple[pl.DataFrame, int]:
+    df = source.collect()
+    projected = df.select(columns) if columns else df
+    if sort_by is None:
+        page = projected.slice(offset, limit)
+    else:
+        key = f"{source.fingerprint}:{sort_by}:{descending}"
+        order = preview_sort_index.get(key)
+        if order is None:
+            order = df.get_column(sort_by).arg_sort(descending=descending, nulls_last=True)
+            preview_sort_index.put(key, order)
+        page = projected.select(pl.all().gather(order.slice(offset, limit)))
+    return page, df.height
+
+
+def _format_column(s: pl.Series) -> list[str]:
+    # NOTE: Casting formats the whole column at once from its Arrow buffers
+    if s.dtype.is_nested():
+        values = [None if v is None else str(v) for v in s.to_list()]
+    else:
+        values = s.cast(pl.String).to_list()
+    return ["null" if v is None else html.escape(v) for v in values]
+
+
+def preview_url(
+    path: str,
+    node_id: str,
+    offset: int,
+    sort_by: str | None,
+    descending: bool,
+    columns: list[str] | None,
+) -> str:
+    params: dict[str, str | int | bool | list[str]] = {"node_id": node_id, "offset": offset}
+    if sort_by is not None:
+        params["sort_by"] = sort_by
+        params["descending"] = descending
+    if columns:
+        params["columns"] = columns
+    return html.escape(f"{path}?{urlencode(params, doseq=True)}")
+
+
+TABLE_PREVIEW_URL = "/graph/view/table"
+TABLE_ROWS_URL = "/graph/view/rows"
+
+
+def make_table_rows_html(page: pl.DataFrame, next_url: str | None) -> str:
+    cols = [_format_column(s) for s in page.iter_columns()]
+    rows = ["<tr>" + "".join(f"<td>{v}</td>" for v in row) + "</tr>" for row in zip(*cols)]
+    # NOTE: Scrolling the last row into view fetches the next page right after it
+    if next_url is not None and rows:
+        rows[-1] = f'<tr hx-get="{next_url}" hx-trigger="revealed" hx-swap="afterend">' + rows[-1][4:]
+    return "".join(rows)
+
+
+def make_table_html(
+    page: pl.DataFrame,
+    html_id: str,
+    rows_html: str,
+    sort_urls: dict[str, str],
+    sort_by: str | None,
+    descending: bool,
+) -> str:
     # NOTE: class 'table-pin-rows' causes a z-order bug where table header is drawn over the sidebar
     table_html_classes = "dataframe table"
-    gen_html = df._repr_html_()
-    left = gen_html.index("<table")
-    right = gen_html.index("</table>")
-    replace_from = '<table border="1" class="dataframe">'
-    replace_to = f'<table class="{table_html_classes}" id="{html_id}">'
-    final = gen_html[left : right + len("</table>")].replace(replace_from, replace_to)
-    return final
+    headers = []
+    for name, dtype in page.schema.items():
+        arrow = ("▼" if descending else "▲") if name == sort_by else ""
+        headers.append(
+            f'<th class="cursor-pointer" hx-get="{sort_urls[name]}" '
+            f'hx-target="#{html_id}" hx-swap="outerHTML">'
+            f"{html.escape(name)} {arrow}<br><small>{html.escape(str(dtype))}</small></th>",
+        )
+    return (
+        f'<table class="{table_html_classes}" id="{html_id}">'
+        f"<thead><tr>{''.join(headers)}</tr></thead>"
+        f"<tbody>{rows_html}</tbody>"
+        "</table>"
+    )
 
 
 def get_user_id(request: Request, response: Response) -> str:
@@ -44,11 +141,109 @@ def get_user_id(request: Request, response: Response) -> str:
 UserDep = Annotated[str, Depends(get_user_id)]
 
 
+async def get_user_graph(user_id: UserDep) -> AsyncGenerator[Graph, None]:
+    graph = await app_state.get_user_graph(user_id)
+    yield graph
+    # NOTE: Runs before the response is sent so a lost update still reaches the client as a 409
+    await app_state.commit_user_graph(user_id)
+
+
+GraphDep = Annotated[Graph, Depends(get_user_graph)]
+
+
+# NOTE: Graph versions restart from a checkpoint after a crash or restart, so an ETag from before
+# could name a different graph with the same version
+_BOOT_NONCE = uuid.uuid4().hex
+
+
+def graph_etag(user_id: str, g: Graph, *parts: str) -> str:
+    """Strong ETag of a response that only depends on the user's graph and `parts`."""
+    key = ":".join([_BOOT_NONCE, user_id, str(g.version), templates_version(), *parts])
+    return f'"{g.version}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """Empty 304 response when the client already holds the representation tagged `etag`."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    if etag not in tags and "*" not in tags:
+        return None
+    return with_etag(Response(status_code=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+def with_etag(response: ResponseT, etag: str) -> ResponseT:
+    response.headers["ETag"] = etag
+    # NOTE: The same URL has a different graph per `user_id` cookie, so only the browser may cache it
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["Vary"] = "Cookie"
+    return response
+
+
+async def checkpoint_periodically() -> None:
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL_SECONDS)
+        try:
+            n_written = await app_state.checkpoint()
+            if n_written:
+                logger.debug("Checkpointed %s user graphs", n_written)
+        except Exception:
+            logger.exception("Failed to checkpoint user graphs")
+
+
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:
-    create_db_and_tables()
+    await create_db_and_tables()
+    n_templates = precompile_templates()
+    logger.debug("Precompiled %s templates", n_templates)
+    write_plotlyjs(STATIC_DIR / "lib")
+    n_compressed = precompress_static(STATIC_DIR)
+    logger.debug("Precompressed %s static files", n_compressed)
+    n_stale = chart_cache.remove_stale_spills()
+    logger.debug("Removed %s stale chart spills", n_stale)
+    checkpointer = asyncio.create_task(checkpoint_periodically())
     try:
         yield
     finally:
-        with get_db_context() as db:
-            app_state.persist_all_to_db(db)
+        checkpointer.cancel()
+        compute_pool.shutdown()
+        # NOTE: Only changes made since the last periodic checkpoint are left to flush
+        await app_state.checkpoint()
+        await engine.dispose()
+        chart_cache.remove_spilled()
+
+
+def make_table_preview_html(
+    source: TableSource,
+    node_id: str,
+    offset: int,
+    limit: int,
+    sort_by: str | None = None,
+    descending: bool = False,
+    columns: list[str] | None = None,
+    rows_only: bool = False,
+) -> str:
+    """Render one page of a table node, sorted server-side when `sort_by` is set."""
+    page, n_rows = get_preview_page(source, offset, limit, sort_by, descending, columns)
+    next_offset = offset + page.height
+    next_url = None
+    if next_offset < n_rows:
+        next_url = preview_url(TABLE_ROWS_URL, node_id, next_offset, sort_by, descending, columns)
+    rows_html = make_table_rows_html(page, next_url)
+    if rows_only:
+        return rows_html
+
+    sort_urls = {
+        # NOTE: Clicking the sorted column again flips its direction
+        name: preview_url(
+            TABLE_PREVIEW_URL,
+            node_id,
+            0,
+            name,
+            name == sort_by and not descending,
+            columns,
+        )
+        for name in page.columns
+    }
+    return make_table_html(page, f"tbl_{node_id}", rows_html, sort_urls, sort_by, descending)
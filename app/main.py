@@ -1,13 +1,18 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 
+from app.config import GZIP_LEVEL, GZIP_MIN_BYTES, UPLOAD_MAX_BYTES
+from app.dependencies.static_files import STATIC_DIR, STATIC_URL_PREFIX, CachedStaticFiles
 from app.dependencies.utils import lifespan
+from app.middlewares.compression import FlushingGZipMiddleware
 from app.middlewares.custom_logging import LogClientIPMiddleware, LogExceptionMiddleware
+from app.middlewares.metrics import RequestMetricsMiddleware
+from app.middlewares.upload_limit import UploadLimitMiddleware
 from app.routers import (
     charts,
     files,
     fragments,
     graph,
+    metrics,
     pages,
     root,
 )
@@ -18,12 +23,20 @@ application = FastAPI(
     title="MyDAT",
     lifespan=lifespan,
 )
-application.mount("/static", StaticFiles(directory="app/static"), name="static")
+application.mount(STATIC_URL_PREFIX, CachedStaticFiles(directory=STATIC_DIR), name="static")
 application.add_middleware(LogExceptionMiddleware)
 application.add_middleware(LogClientIPMiddleware)
+# NOTE: Responses that already carry a Content-Encoding, like precompressed static files, pass through,
+# and streamed pages are flushed per chunk so their head still reaches the browser early
+application.add_middleware(FlushingGZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
+# NOTE: Must run before FastAPI parses the form, which spools the whole body to disk
+application.add_middleware(UploadLimitMiddleware, path_prefix="/files/upload", max_bytes=UPLOAD_MAX_BYTES)
+# NOTE: Added last so it is outermost and times the other middlewares too
+application.add_middleware(RequestMetricsMiddleware)
 application.include_router(root.router)
 application.include_router(pages.router)
 application.include_router(fragments.router)
 application.include_router(files.router)
 application.include_router(charts.router)
 application.include_router(graph.router)
+application.include_router(metrics.router)
@@ -0,0 +1,67 @@
+import gzip
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class FlushingGZipMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int, compresslevel: int) -> None:
+        """Gzip responses for clients that accept it, flushing the compressor after every body message.
+
+        Starlette's `GZipMiddleware` keeps compressed output buffered in zlib across messages, which
+        holds back the chunks of streamed pages. Here each message goes out as soon as it is sent,
+        and responses that already carry a `Content-Encoding` pass through untouched.
+        """
+        self.app = app
+        self._minimum_size = minimum_size
+        self._compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message | None = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # NOTE: Held back until the first body message shows whether to compress
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                assert start_message is not None
+                headers = MutableHeaders(raw=start_message["headers"])
+                if "content-encoding" in headers or (not more_body and len(body) < self._minimum_size):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                headers["Content-Encoding"] = "gzip"
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = gzip.compress(body, compresslevel=self._compresslevel, mtime=0)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                await send(start_message)
+
+            # NOTE: A sync flush ends each message on a byte boundary the browser can already decode
+            flush_mode = zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH
+            chunk = compressor.compress(body) + compressor.flush(flush_mode)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,12 +1,26 @@
+import atexit
 import logging
-from collections.abc import Awaitable
+import logging.handlers
+import queue
+from functools import lru_cache
 from pathlib import Path
-from typing import Callable, ClassVar, final, override
+from typing import Any, ClassVar, final, override
 
+import orjson
 from colorama import Fore, Style
-from fastapi import HTTPException, Request, Response, status
+from fastapi import status
 from fastapi.responses import ORJSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import LOG_FORMAT, LOG_LEVEL
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+@lru_cache(maxsize=1024)
+def _is_project_file(pathname: str) -> bool:
+    # NOTE: Resolving hits the filesystem, and a process only ever logs from a few hundred call sites
+    return Path(pathname).resolve().is_relative_to(PROJECT_ROOT)
 
 
 # Define a custom formatter for colored output
@@ -20,7 +34,6 @@ class ColorFormatter(logging.Formatter):
         "CRITICAL": Fore.MAGENTA,
     }
     GRAY = Fore.LIGHTBLACK_EX
-    PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
     @override
     def format(self, record: logging.LogRecord) -> str:
@@ -32,7 +45,7 @@ class ColorFormatter(logging.Formatter):
         sep = "|"
 
         # Include filename and line number only for project files
-        if Path(record.pathname).resolve().is_relative_to(self.PROJECT_ROOT):
+        if _is_project_file(record.pathname):
             meta = f"{self.GRAY}{record.filename}:{record.lineno}{sep}{timestamp}{reset}"
             fmt = f"%(levelname)s{sep}{meta}{sep} %(message)s"
         else:
@@ -44,54 +57,105 @@ class ColorFormatter(logging.Formatter):
         return super().format(record)
 
 
+@final
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line without colors, for log collectors in production."""
+
+    @override
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if _is_project_file(record.pathname):
+            entry["location"] = f"{record.filename}:{record.lineno}"
+        return orjson.dumps(entry).decode()
+
+
 # Create a shared logger instance for the app
 logger = logging.getLogger("app_logger")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
 
 # Create a handler with custom formatting
 handler = logging.StreamHandler()
-formatter = ColorFormatter(datefmt="%Y-%m-%d %H:%M:%S")
+match LOG_FORMAT:
+    case "color":
+        formatter: logging.Formatter = ColorFormatter(datefmt="%Y-%m-%d %H:%M:%S")
+    case "json":
+        formatter = JSONFormatter(datefmt="%Y-%m-%dT%H:%M:%S%z")
+    case _:
+        raise ValueError(f"Unknown log format '{LOG_FORMAT}', expected 'color' or 'json'")
 handler.setFormatter(formatter)
 
+# NOTE: Only the handler I/O moves to the listener thread, so a slow terminal or pipe never stalls
+# the event loop. `QueueHandler.prepare` still interpolates each message on the calling thread
+log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+queue_listener.start()
+atexit.register(queue_listener.stop)
+
 # Assign the handler to the shared logger
-logger.handlers = [handler]
+logger.handlers = [queue_handler]
 logger.propagate = False
 
 # Configure uvicorn loggers to use the same formatter
 for uvicorn_logger_name in ("uvicorn", "uvicorn.access"):
     uvicorn_logger = logging.getLogger(uvicorn_logger_name)
-    uvicorn_logger.setLevel(logging.DEBUG)
-    uvicorn_logger.handlers = [handler]
+    uvicorn_logger.setLevel(LOG_LEVEL)
+    uvicorn_logger.handlers = [queue_handler]
     uvicorn_logger.propagate = False
 
 
-class LogClientIPMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self,
-        request: Request,
-        call_next: Callable[[Request], Awaitable[Response]],
-    ) -> Response:
-        if not request.client:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Missing client data")
-        client_host, client_port = request.client.host, request.client.port
-        logger.debug(f"Got a request from {client_host}:{client_port}")
-        response = await call_next(request)
-        return response
-
-
-class LogExceptionMiddleware(BaseHTTPMiddleware):
-    async def dispatch(
-        self,
-        request: Request,
-        call_next: Callable[[Request], Awaitable[Response]],
-    ) -> Response:
+class LogClientIPMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = scope.get("client")
+        if not client:
+            response = ORJSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"detail": "Missing client data"},
+            )
+            await response(scope, receive, send)
+            return
+        logger.debug("Got a request from %s:%s", client[0], client[1])
+        await self.app(scope, receive, send)
+
+
+class LogExceptionMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_tracking_start(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_tracking_start)
         # TODO: Define application-specific empty exception here
         # custom exception -> 422
         # any other exception -> 500
         except Exception as e:
             logger.exception("An error occured during processing of request")
+            # NOTE: Once headers are out there is no way to turn the response into an error
+            if response_started:
+                raise
             response = ORJSONResponse(
                 status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                 content={
@@ -99,4 +163,4 @@ class LogExceptionMiddleware(BaseHTTPMiddleware):
                     "msg": str(e),
                 },
             )
-        return response
+            await response(scope, receive, send)
@@ -0,0 +1,34 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.dependencies.metrics import request_latency
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        """Record the latency of every HTTP request per route template and status code."""
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # NOTE: Route templates rather than raw paths keep the number of series bounded
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            elapsed = time.perf_counter() - start
+            request_latency.observe(elapsed, scope["method"], route_path, str(status_code))
@@ -0,0 +1,69 @@
+from starlette import status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.middlewares.custom_logging import logger
+
+# NOTE: Multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app: ASGIApp, path_prefix: str, max_bytes: int) -> None:
+        """Reject request bodies over `max_bytes` with 413 before the multipart parser spools them.
+
+        Bodies with a `Content-Length` are rejected upfront, chunked ones as soon as the limit is
+        crossed, so an oversized upload never lands on disk.
+        """
+        self.app = app
+        self._path_prefix = path_prefix
+        self._max_file_bytes = max_bytes
+        self._max_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self._path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self._max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self._max_bytes:
+                    # NOTE: Looks like a client disconnect to the app, which stops parsing the body
+                    rejected = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            # NOTE: Whatever the app answers to the fake disconnect is replaced by the 413
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+        if rejected:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        logger.error("Upload to %s exceeds limit of %s bytes", scope["path"], self._max_file_bytes)
+        response = JSONResponse(
+            {"detail": f"File exceeds upload limit of {self._max_file_bytes} bytes"},
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+        await response(scope, receive, send)
@@ -1,23 +1,19 @@
 from typing import Annotated
 
-import polars as pl
 from fastapi import APIRouter, Form, Request
 from fastapi.responses import HTMLResponse
 
-from app.db.session import SessionDep
+from app.dependencies.chart_cache import get_chart_html
 from app.dependencies.specs.chart import (
     ChartBar,
     ChartHeatmap,
     ChartHistogram,
     ChartKind,
     ChartScatter,
-    DataChart,
     DimensionValue,
-    fig_html,
 )
 from app.dependencies.specs.graph import GraphNode, KindNode
-from app.dependencies.state import app_state
-from app.dependencies.utils import UserDep
+from app.dependencies.utils import GraphDep, UserDep
 from app.middlewares.custom_logging import logger
 from app.templates.renderer import render
 
@@ -27,39 +23,38 @@ router = APIRouter(
     dependencies=[],
 )
 
+# NOTE: Not dimensions, these are validated and applied by `ChartHistogram.update_bins`
+HISTOGRAM_BIN_SETTINGS = {"bin_rule", "bin_count", "bin_width"}
+
 
 @router.post("/create", response_class=HTMLResponse)
 async def create_new_chart(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     chart_selection_radio: Annotated[str, Form()],
     chart_src_selector: Annotated[str, Form()],
 ) -> HTMLResponse:
-    logger.debug(f"CHART: {user_id} -> {chart_selection_radio}:{chart_src_selector}")
-
-    g = app_state.get_user_graph(user_id, db)
-    src_table = g.get_node_data(chart_src_selector)
+    logger.debug("CHART: %s -> %s:%s", user_id, chart_selection_radio, chart_src_selector)
 
-    # NOTE: Uses first file/table as initial DF for new chart creation
-    main_df = src_table.data
-    assert isinstance(main_df, pl.DataFrame)
+    # NOTE: Default dimensions only need the column names and dtypes of the source table
+    src_schema = g.get_table_schema(chart_src_selector)
 
     try:
         chart_kind = ChartKind[chart_selection_radio.upper()]
     except KeyError as e:
-        logger.error(f"Failed to parse ChartKind: '{chart_selection_radio}'")
+        logger.error("Failed to parse ChartKind: '%s'", chart_selection_radio)
         raise ValueError(f"Failed to parse ChartKind: '{chart_selection_radio}'") from e
 
     match chart_kind:
         case ChartKind.SCATTER:
-            chart_data = ChartScatter.default(main_df)
+            chart_data = ChartScatter.default(src_schema)
         case ChartKind.BAR:
-            chart_data = ChartBar.default(main_df)
+            chart_data = ChartBar.default(src_schema)
         case ChartKind.HISTOGRAM:
-            chart_data = ChartHistogram.default(main_df)
+            chart_data = ChartHistogram.default(src_schema)
         case ChartKind.HEATMAP:
-            chart_data = ChartHeatmap.default(main_df)
+            chart_data = ChartHeatmap.default(src_schema)
 
     user_charts_for_naming = g.get_nodes_by_kind(kind=KindNode.CHART, subkind=chart_kind)
     new_chart = GraphNode(
@@ -70,11 +65,10 @@ async def create_new_chart(
     )
     chart_id = g.add_node(new_chart)
     g.add_edge(chart_src_selector, chart_id)
-    logger.warning(g)
+    logger.debug("Graph of user %s: %r", user_id, g)
 
-    fig = chart_data.make_fig(main_df)
     user_charts = g.get_nodes_by_kind(kind=KindNode.CHART)
-    chart_html = fig_html(fig)
+    chart_html = await get_chart_html(g, chart_id)
 
     return render(
         {
@@ -101,24 +95,22 @@ async def create_new_chart(
 async def update_chart(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     chart_id: Annotated[str, Form()],
     dimension_name: Annotated[str, Form()],
     dimension_value: Annotated[str, Form()],
 ) -> HTMLResponse:
-    g = app_state.get_user_graph(user_id, db)
-
     current_chart = g.get_node_data(chart_id)
-    _, chart_parent_data = g.get_parents(chart_id)[0]
 
-    current_dim: DimensionValue = getattr(current_chart.data, dimension_name)
-    current_dim.selected = dimension_value
-    setattr(current_chart.data, dimension_name, current_dim)
+    if isinstance(current_chart.data, ChartHistogram) and dimension_name in HISTOGRAM_BIN_SETTINGS:
+        current_chart.data.update_bins(dimension_name, dimension_value)
+    else:
+        current_dim: DimensionValue = getattr(current_chart.data, dimension_name)
+        current_dim.selected = dimension_value
+        setattr(current_chart.data, dimension_name, current_dim)
+    g.touch()
 
-    assert isinstance(current_chart.data, DataChart)
-    assert isinstance(chart_parent_data.data, pl.DataFrame)
-    fig = current_chart.data.make_fig(chart_parent_data.data)
-    chart_html = fig_html(fig)
+    chart_html = await get_chart_html(g, chart_id)
 
     return render(
         {
@@ -1,14 +1,12 @@
 from pathlib import Path
 
-import polars as pl
 from fastapi import APIRouter, HTTPException, Request, UploadFile, status
 from fastapi.responses import HTMLResponse
 
-from app.db.session import SessionDep
+from app.dependencies.ingest import ingest_csv
 from app.dependencies.specs.graph import GraphNode, KindNode
 from app.dependencies.specs.table import KindTable
-from app.dependencies.state import app_state
-from app.dependencies.utils import UserDep
+from app.dependencies.utils import GraphDep, UserDep
 from app.middlewares.custom_logging import logger
 from app.templates.renderer import render
 
@@ -24,28 +22,26 @@ async def receive_file(
     request: Request,
     uploaded_file: UploadFile,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
 ) -> HTMLResponse:
-    logger.debug(f"Uploading: {user_id}, {uploaded_file.filename}, {uploaded_file}")
-
-    contents = await uploaded_file.read()
-    file_df = pl.read_csv(contents)
-    logger.debug(f"Dataframe processed of shape: {file_df.shape}")
+    logger.debug("Uploading: %s, %s, %s", user_id, uploaded_file.filename, uploaded_file)
 
     if not (uploaded_file.filename and uploaded_file.size):
         logger.error("Invalid file data")
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid file data")
 
-    g = app_state.get_user_graph(user_id, db)
+    stored_table = await ingest_csv(uploaded_file)
+    logger.debug("Table stored with id: %s", stored_table.table_id)
+
     g.add_node(
         GraphNode(
             name=Path(uploaded_file.filename).stem,
             kind=KindNode.TABLE,
             subkind=KindTable.UPLOADED,
-            data=file_df,
+            data=stored_table,
         ),
     )
-    logger.warning(g)
+    logger.debug("Graph of user %s: %r", user_id, g)
     user_files = g.get_nodes_by_kind(kind=KindNode.TABLE)
 
     return render(
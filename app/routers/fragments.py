@@ -1,8 +1,6 @@
-import polars as pl
 from fastapi import APIRouter, Request, status
 from fastapi.responses import HTMLResponse
 
-from app.db.session import SessionDep
 from app.dependencies.specs.analysis import (
     AnalysisAggregate,
     AnalysisCalculate,
@@ -13,8 +11,7 @@ from app.dependencies.specs.analysis import (
     KindAnalysis,
 )
 from app.dependencies.specs.graph import KindNode
-from app.dependencies.state import app_state
-from app.dependencies.utils import UserDep
+from app.dependencies.utils import GraphDep, UserDep
 from app.middlewares.custom_logging import logger
 from app.templates.renderer import render
 
@@ -29,12 +26,11 @@ router = APIRouter(
 async def get_modal_filter(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     node_subkind: str,
 ) -> HTMLResponse:
-    logger.debug(f"Fetching fragment filter modal for user {user_id}")
+    logger.debug("Fetching fragment filter modal for user %s", user_id)
 
-    g = app_state.get_user_graph(user_id, db)
     user_files = g.get_nodes_by_kind(kind=KindNode.TABLE)
 
     try:
@@ -71,15 +67,12 @@ async def get_modal_filter(
 async def update_dropdown(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     new_filter_src: str,
 ) -> HTMLResponse:
-    logger.debug(f"Fetching fragment filter src dropdown for user {user_id}")
+    logger.debug("Fetching fragment filter src dropdown for user %s", user_id)
 
-    g = app_state.get_user_graph(user_id, db)
-    node_data = g.get_node_data(new_filter_src).data
-    assert isinstance(node_data, pl.DataFrame)
-    cols = node_data.columns
+    cols = g.get_table_schema(new_filter_src).names()
 
     pred = FilterPredicate.default()
     pred.col.options = cols
@@ -100,18 +93,15 @@ async def update_dropdown(
 async def add_filter_pred_row(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     chosen_table_id: str,
 ) -> HTMLResponse:
-    logger.debug(f"Fetching fragment predicate row for user {user_id}")
+    logger.debug("Fetching fragment predicate row for user %s", user_id)
 
-    g = app_state.get_user_graph(user_id, db)
     if len(chosen_table_id) == 0:
         cols = []
     else:
-        node_data = g.get_node_data(chosen_table_id).data
-        assert isinstance(node_data, pl.DataFrame)
-        cols = node_data.columns
+        cols = g.get_table_schema(chosen_table_id).names()
 
     pred = FilterPredicate.default()
     pred.col.options = cols
@@ -1,10 +1,10 @@
 from typing import Annotated
 
-import polars as pl
-from fastapi import APIRouter, Form, Request, status
+from fastapi import APIRouter, Form, Query, Request, Response, status
 from fastapi.responses import HTMLResponse, ORJSONResponse
 
-from app.db.session import SessionDep
+from app.config import PREVIEW_MAX_PAGE_ROWS, PREVIEW_PAGE_ROWS
+from app.dependencies.compute import compute_pool
 from app.dependencies.specs.analysis import (
     AnalysisAggregate,
     AnalysisCalculate,
@@ -15,10 +15,16 @@ from app.dependencies.specs.analysis import (
     KindAnalysis,
     TableCol,
 )
-from app.dependencies.specs.graph import GraphNode, KindNode
-from app.dependencies.specs.table import KindTable
-from app.dependencies.state import app_state
-from app.dependencies.utils import UserDep, make_table_html
+from app.dependencies.specs.graph import Graph, GraphNode, KindNode
+from app.dependencies.specs.table import DerivedTable, DtypeClass, KindTable
+from app.dependencies.utils import (
+    GraphDep,
+    UserDep,
+    graph_etag,
+    make_table_preview_html,
+    not_modified,
+    with_etag,
+)
 from app.middlewares.custom_logging import logger
 from app.templates.renderer import render
 
@@ -31,26 +37,34 @@ router = APIRouter(
 
 @router.get("/")
 async def get_graph_data(
+    request: Request,
     user_id: UserDep,
-    db: SessionDep,
-) -> ORJSONResponse:
-    logger.debug(f"Fetching graph data for user {user_id}")
+    g: GraphDep,
+    since: Annotated[int | None, Query(ge=0)] = None,
+) -> Response:
+    logger.debug("Fetching graph data for user %s since version %s", user_id, since)
+
+    etag = graph_etag(user_id, g, "graph", str(since))
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
 
-    g = app_state.get_user_graph(user_id, db)
-    d = g.to_cytoscape()
-    return ORJSONResponse(d)
+    # NOTE: Fall back to the full graph when the changelog no longer reaches back to `since`
+    changes = None if since is None else g.changes_since(since)
+    if changes is None:
+        d = g.to_client()
+    else:
+        d = {"version": g.version, "changes": changes}
+    return with_etag(ORJSONResponse(d), etag)
 
 
 @router.post("/delete")
 async def delete_node(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     node_id: Annotated[str, Form()],
 ) -> HTMLResponse:
-    logger.debug(f"Deleting node {node_id} for user {user_id}")
-
-    g = app_state.get_user_graph(user_id, db)
+    logger.debug("Deleting node %s for user %s", node_id, user_id)
 
     # TODO: return HTML for toast message telling how many were deleted
     n_deleted = g.delete_cascade(node_id)
@@ -73,12 +87,12 @@ async def delete_node(
 async def view_node(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     node_id: str,
     node_kind: str,
     node_subkind: str,
 ) -> HTMLResponse:
-    logger.debug(f"Sending node {node_id} data for user {user_id}")
+    logger.debug("Sending node %s data for user %s", node_id, user_id)
 
     # NOTE: triggers
     # - user clicks on graph node:
@@ -90,8 +104,6 @@ async def view_node(
     #   - new chart button
     #     same as current (fixed modal triggered which is already in the HTML on startup)
 
-    g = app_state.get_user_graph(user_id, db)
-
     try:
         node_kind = KindNode[node_kind.upper()]
     except KeyError as e:
@@ -100,10 +112,13 @@ async def view_node(
     match node_kind:
         case KindNode.TABLE:
             assert node_id != ""
-            node_data = g.get_node_data(node_id).data
-            assert isinstance(node_data, pl.DataFrame)
-            table = node_data.head(10)
-            table_html = make_table_html(table, f"tbl_{node_id}")
+            table_html = await compute_pool.run(
+                make_table_preview_html,
+                g.table_source(node_id),
+                node_id,
+                0,
+                PREVIEW_PAGE_ROWS,
+            )
             logger.debug("sending table data")
             return render(
                 {
@@ -154,32 +169,98 @@ async def view_node(
             )
 
 
+@router.get("/view/table")
+async def view_table_page(
+    user_id: UserDep,
+    g: GraphDep,
+    node_id: str,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(gt=0, le=PREVIEW_MAX_PAGE_ROWS)] = PREVIEW_PAGE_ROWS,
+    sort_by: str | None = None,
+    descending: bool = False,
+    columns: Annotated[list[str] | None, Query()] = None,
+) -> HTMLResponse:
+    logger.debug("Sending table %s sorted by %s for user %s", node_id, sort_by, user_id)
+
+    _check_preview_columns(g, node_id, sort_by, columns)
+    table_html = await compute_pool.run(
+        make_table_preview_html,
+        g.table_source(node_id),
+        node_id,
+        offset,
+        limit,
+        sort_by,
+        descending,
+        columns,
+    )
+    return HTMLResponse(table_html)
+
+
+@router.get("/view/rows")
+async def view_table_rows(
+    user_id: UserDep,
+    g: GraphDep,
+    node_id: str,
+    offset: Annotated[int, Query(ge=0)],
+    limit: Annotated[int, Query(gt=0, le=PREVIEW_MAX_PAGE_ROWS)] = PREVIEW_PAGE_ROWS,
+    sort_by: str | None = None,
+    descending: bool = False,
+    columns: Annotated[list[str] | None, Query()] = None,
+) -> HTMLResponse:
+    logger.debug("Sending rows %s..%s of table %s for user %s", offset, offset + limit, node_id, user_id)
+
+    _check_preview_columns(g, node_id, sort_by, columns)
+    rows_html = await compute_pool.run(
+        make_table_preview_html,
+        g.table_source(node_id),
+        node_id,
+        offset,
+        limit,
+        sort_by,
+        descending,
+        columns,
+        rows_only=True,
+    )
+    return HTMLResponse(rows_html)
+
+
+def _check_preview_columns(g: Graph, node_id: str, sort_by: str | None, columns: list[str] | None) -> None:
+    known = set(g.get_table_schema(node_id).names())
+    for col in [sort_by, *(columns or [])]:
+        if col is not None and col not in known:
+            raise ValueError(f"Unknown column '{col}' in table '{node_id}'")
+
+
 @router.post("/create/filter")
 async def create_filter_node(
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     new_filter_src: Annotated[str, Form()],
     gc_filter_src: Annotated[list[str], Form()],
     new_filter_op: Annotated[list[str], Form()],
     new_filter_comp: Annotated[list[str], Form()],
 ) -> ORJSONResponse:
-    logger.debug(f"Fetching graph data for user {user_id}")
+    logger.debug("Fetching graph data for user %s", user_id)
 
-    g = app_state.get_user_graph(user_id, db)
     src_node_data = g.get_node_data(new_filter_src)
-    assert isinstance(src_node_data.data, pl.DataFrame)
+    src_schema = g.get_table_schema(new_filter_src)
+    src_cols = src_schema.names()
 
     # TODO: implement proper logic to differentiate filter ops based on src col type
     # also convert the `new_filter_comp[]` to the correct type in `val` before comparison
     preds = [
         FilterPredicate(
-            TableCol(col, src_node_data.data.columns),
+            TableCol(col, src_cols),
             FilterOperation.from_string(op),
             float(val),
         )
         for col, op, val in zip(gc_filter_src, new_filter_op, new_filter_comp)
     ]
+    for pred in preds:
+        if src_schema.columns.get(pred.col.selected) != DtypeClass.NUMERIC:
+            raise ValueError(f"Cannot compare column '{pred.col.selected}' against a number")
     analysis_op = AnalysisFilter(preds)
+
     # TODO: pretty bad naming scheme (converts cols array intro raw string)
     filter_node_name = f"{src_node_data.name}_filter_{gc_filter_src}"
     filter_node_id = g.add_node(
@@ -192,18 +273,18 @@ async def create_filter_node(
     )
     g.add_edge(new_filter_src, filter_node_id)
 
-    filtered_df = analysis_op.apply(src_node_data.data)
+    # NOTE: Rows of the result are only computed when a chart or preview needs them
     result_node_id = g.add_node(
         GraphNode(
             name=f"{filter_node_name}_result",
             kind=KindNode.TABLE,
             subkind=KindTable.CALCULATED,
-            data=filtered_df,
+            data=DerivedTable(),
         ),
     )
     g.add_edge(filter_node_id, result_node_id)
 
-    logger.warning(g)
+    logger.debug("Graph of user %s: %r", user_id, g)
 
-    d = g.to_cytoscape()
-    return ORJSONResponse(d)
+    # NOTE: Clients pick up the new elements from `/graph/?since=`, only the new ids are returned
+    return ORJSONResponse({"filter_id": filter_node_id, "result_id": result_node_id})
@@ -0,0 +1,87 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.dependencies.cache import SizedLRUCache
+from app.dependencies.chart_cache import chart_cache
+from app.dependencies.compute import compute_pool
+from app.dependencies.metrics import format_metric, request_latency, stage_latency
+from app.dependencies.specs.chart import heatmap_cells
+from app.dependencies.specs.graph import materialized_tables
+from app.dependencies.state import app_state
+from app.dependencies.utils import preview_sort_index
+
+router = APIRouter(
+    tags=["metrics"],
+    dependencies=[],
+)
+
+CACHES: dict[str, SizedLRUCache] = {
+    "materialized_tables": materialized_tables,
+    "chart_html": chart_cache,
+    "heatmap_cells": heatmap_cells,
+    "preview_sort_index": preview_sort_index,
+}
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    # NOTE: Everything below is read from counters that already exist, nothing is sampled in between scrapes
+    lines = [*request_latency.expose(), *stage_latency.expose()]
+    lines += format_metric(
+        "mydat_resident_users",
+        "gauge",
+        "User graphs held in memory by this process.",
+        {"": app_state.resident_users()},
+    )
+    lines += format_metric(
+        "mydat_resident_bytes",
+        "gauge",
+        "Bytes of tables referenced by resident user graphs.",
+        {"": app_state.total_resident_bytes()},
+    )
+    lines += format_metric(
+        "mydat_compute_in_flight",
+        "gauge",
+        "Jobs running or queued on the compute pool.",
+        {"": compute_pool.in_flight},
+    )
+    lines += format_metric(
+        "mydat_compute_rejected_total",
+        "counter",
+        "Jobs rejected with 503 because the compute pool was saturated.",
+        {"": compute_pool.rejected},
+    )
+    lines += format_metric(
+        "mydat_cache_bytes",
+        "gauge",
+        "Bytes held by each in-memory cache.",
+        {f'cache="{name}"': cache.total_bytes for name, cache in CACHES.items()},
+    )
+    lines += format_metric(
+        "mydat_chart_spill_bytes",
+        "gauge",
+        "Bytes of rendered charts spilled to disk by this worker.",
+        {"": chart_cache.spilled_bytes},
+    )
+    lines += format_metric(
+        "mydat_cache_hits_total",
+        "counter",
+        "Lookups answered from each cache.",
+        {f'cache="{name}"': cache.hits for name, cache in CACHES.items()},
+    )
+    lines += format_metric(
+        "mydat_cache_misses_total",
+        "counter",
+        "Lookups that missed each cache.",
+        {f'cache="{name}"': cache.misses for name, cache in CACHES.items()},
+    )
+    lines += format_metric(
+        "mydat_cache_hit_ratio",
+        "gauge",
+        "Hits over all lookups of each cache since startup.",
+        {
+            f'cache="{name}"': cache.hits / max(1, cache.hits + cache.misses)
+            for name, cache in CACHES.items()
+        },
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
@@ -1,15 +1,14 @@
-import polars as pl
-from fastapi import APIRouter, Request
+import plotly.io as pio
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import HTMLResponse
 
-from app.db.session import SessionDep
 from app.dependencies.specs.analysis import FilterOperation
-from app.dependencies.specs.chart import DataChart, fig_html, get_available_chart_kinds
+from app.dependencies.chart_cache import get_chart_html
+from app.dependencies.specs.chart import get_available_chart_kinds
 from app.dependencies.specs.graph import KindNode
-from app.dependencies.state import app_state
-from app.dependencies.utils import UserDep
+from app.dependencies.utils import GraphDep, UserDep, graph_etag, not_modified, with_etag
 from app.middlewares.custom_logging import logger
-from app.templates.renderer import render
+from app.templates.renderer import render, render_stream
 
 router = APIRouter(
     prefix="/pages",
@@ -22,14 +21,17 @@ router = APIRouter(
 async def get_page_relationships(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
-) -> HTMLResponse:
+    g: GraphDep,
+) -> Response:
     logger.debug("Sending dataflow page")
 
-    g = app_state.get_user_graph(user_id, db)
+    etag = graph_etag(user_id, g, "dataflow")
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+
     user_files = g.get_nodes_by_kind(KindNode.TABLE)
     chart_kinds = get_available_chart_kinds()
-    return render(
+    response = render_stream(
         {
             "template_name": "page_dataflow.jinja",
             "context": {
@@ -37,32 +39,31 @@ async def get_page_relationships(
                 "files": user_files,
                 "filter_ops": FilterOperation.list_all(),
                 "chart_kinds": chart_kinds,
-                "graph_json": g.to_cytoscape(),
+                "graph_json": g.to_client(),
             },
         },
     )
+    return with_etag(response, etag)
 
 
 @router.get("/chart", response_class=HTMLResponse)
 async def get_chart_page(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     chart_id: str,
-) -> HTMLResponse:
+) -> Response:
     logger.debug("Sending chart page")
 
-    g = app_state.get_user_graph(user_id, db)
-    current_chart = g.get_node_data(chart_id)
-    _, chart_parent_data = g.get_parents(chart_id)[0]
+    # NOTE: The rendered chart also depends on the plotly theme, which is global
+    etag = graph_etag(user_id, g, "chart", chart_id, pio.templates.default)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
 
-    # TODO: Think of a way to avoid recreating this everytime
-    assert isinstance(current_chart.data, DataChart)
-    assert isinstance(chart_parent_data.data, pl.DataFrame)
-    fig = current_chart.data.make_fig(chart_parent_data.data)
-    chart_html = fig_html(fig)
+    current_chart = g.get_node_data(chart_id)
+    chart_html = await get_chart_html(g, chart_id)
 
-    return render(
+    response = render(
         {
             "template_name": "page_chart.jinja",
             "context": {
@@ -73,3 +74,4 @@ async def get_chart_page(
             },
         },
     )
+    return with_etag(response, etag)
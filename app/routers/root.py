@@ -2,17 +2,15 @@ from typing import Annotated
 
 import plotly.io as pio
 from fastapi import APIRouter, Form, Request
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 
-from app.db.session import SessionDep
 from app.dependencies.chart_theme import register_custom_theme
 from app.dependencies.specs.analysis import AnalysisFilter, FilterOperation
 from app.dependencies.specs.chart import get_available_chart_kinds
 from app.dependencies.specs.graph import KindNode
-from app.dependencies.state import app_state
-from app.dependencies.utils import Theme, UserDep
+from app.dependencies.utils import GraphDep, Theme, UserDep
 from app.middlewares.custom_logging import logger
-from app.templates.renderer import render
+from app.templates.renderer import render, render_stream
 
 router = APIRouter(
     tags=["root"],
@@ -29,13 +27,12 @@ async def favicon() -> FileResponse:
 async def get_homepage(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
-) -> HTMLResponse:
-    g = app_state.get_user_graph(user_id, db)
+    g: GraphDep,
+) -> StreamingResponse:
     user_files = g.get_nodes_by_kind(kind=KindNode.TABLE)
 
-    logger.debug(f"User identified: {user_id} with {len(user_files)} existing files")
-    logger.warning(g)
+    logger.debug("User identified: %s with %s existing files", user_id, len(user_files))
+    logger.debug("Graph of user %s: %r", user_id, g)
 
     chart_kinds = get_available_chart_kinds()
     user_charts = g.get_nodes_by_kind(kind=KindNode.CHART)
@@ -45,7 +42,7 @@ async def get_homepage(
 
     node_data = AnalysisFilter.default()
 
-    return render(
+    return render_stream(
         {
             "template_name": "base.jinja",
             "context": {
@@ -55,7 +52,7 @@ async def get_homepage(
                 "filter_ops": FilterOperation.list_all(),
                 "chart_kinds": chart_kinds,
                 "charts": user_charts,
-                "graph_json": g.to_cytoscape(),
+                "graph_json": g.to_client(),
                 "data": node_data,
                 "table_html": "",
             },
@@ -67,11 +64,10 @@ async def get_homepage(
 async def change_ui_mode(
     request: Request,
     user_id: UserDep,
-    db: SessionDep,
+    g: GraphDep,
     theme_controller: Annotated[bool, Form()],
     chart_id: Annotated[str, Form()],
 ) -> HTMLResponse:
-    g = app_state.get_user_graph(user_id, db)
     user_files = g.get_nodes_by_kind(kind=KindNode.TABLE)
 
     chart_kinds = get_available_chart_kinds()
@@ -80,7 +76,7 @@ async def change_ui_mode(
     theme = Theme.LIGHT if theme_controller else Theme.DARK
     pio.templates.default = register_custom_theme(theme.value)
 
-    logger.debug(f"Changing theme to {theme} from {chart_id=}")
+    logger.debug("Changing theme to %s from chart_id=%r", theme, chart_id)
 
     node_data = AnalysisFilter.default()
 
@@ -127,7 +123,7 @@ async def change_ui_mode(
                 "filter_ops": FilterOperation.list_all(),
                 "chart_kinds": chart_kinds,
                 "charts": user_charts,
-                "graph_json": g.to_cytoscape(),
+                "graph_json": g.to_client(),
             },
             "block_name": "screen_container",
         },
@@ -72,9 +72,92 @@ const catppuccin = {
   },
 };
 
+/** Layout of the dataflow graph, run again whenever elements change. */
+const GRAPH_LAYOUT = {
+  name: "dagre",
+  rankDir: "LR", // Left-to-right instead of Top-to-bottom
+  nodeSep: 50, // Space between nodes
+  edgeSep: 10, // Space between edges
+  rankSep: 200, // Space between hierarchical levels
+};
+
+/** @type {import('cytoscape').Core | null} */
+let cy = null;
+
+/** Graph version the elements of `cy` correspond to. */
+let graphVersion = 0;
+
+/**
+ * Fetch the graph from the server. With `since`, the server answers with the
+ * element changes after that version when it still knows them.
+ *
+ * @param {number | null} since - Version the client already holds.
+ * @returns {Promise<Object<string, any> | null>}
+ */
+async function fetch_graph(since) {
+  const url = since === null ? "/graph/" : `/graph/?since=${since}`;
+  try {
+    const response = await fetch(url);
+    if (response.ok) {
+      return await response.json();
+    }
+  } catch (error) {
+    console.error("Error fetching graph data:", error);
+  }
+  return null;
+}
+
+/** Tail of the queued `sync_graph` runs, so each one starts from the version the last one applied. */
+let graphSync = Promise.resolve();
+
+/**
+ * Bring `cy` up to date with the server, applying add/remove changes in order
+ * or replacing all elements when only the full graph is returned. Overlapping
+ * calls are queued instead of fetching and applying the same changes twice.
+ *
+ * @returns {Promise<void>}
+ */
+function sync_graph() {
+  graphSync = graphSync.then(apply_graph_changes, apply_graph_changes);
+  return graphSync;
+}
+
+async function apply_graph_changes() {
+  const target = cy;
+  if (!target) {
+    return;
+  }
+  const since = graphVersion;
+  const json = await fetch_graph(since);
+  // The graph may have been re-initialized while the request was in flight
+  if (!json || cy !== target || graphVersion !== since || json.version === since) {
+    return;
+  }
+
+  target.batch(() => {
+    if (json.changes) {
+      for (const change of json.changes) {
+        if (change.op === "add") {
+          const id = change.data.id ?? `${change.data.source}-${change.data.target}`;
+          if (target.getElementById(id).empty()) {
+            target.add({ group: change.group, data: { ...change.data, id: id } });
+          }
+        } else if (change.op === "remove") {
+          target.getElementById(change.id).remove();
+        }
+      }
+    } else {
+      target.elements().remove();
+      target.add(json.elements);
+    }
+  });
+  graphVersion = json.version;
+  target.layout(GRAPH_LAYOUT).run();
+}
+
 /**
  * Event listener for HTMX after a swap action. Initializes a Cytoscape graph
- * if a graph container is detected in the swapped content.
+ * if a new graph container is detected in the swapped content.
  *
  * @param {Event} event - The HTMX `htmx:afterSwap` event.
  */
@@ -83,48 +166,42 @@ document.addEventListener("htmx:afterSwap", async (event) => {
   const container = /** @type {HTMLElement | null} */ (
     document.getElementById("graph-container")
   );
-  if (container) {
+  if (container && (!cy || cy.container() !== container)) {
     console.log("Graph container detected. Initializing Cytoscape...");
 
-    /** @type {Object<string, any> | null} */
-    let json = null;
-
-    try {
-      const response = await fetch("/graph");
-      if (response.ok) {
-        json = await response.json();
-      }
-    } catch (error) {
-      console.error("Error fetching graph data:", error);
-    }
-
-    // Use json if valid; otherwise, fallback to window.graphData
-    if (!container) {
-      console.error("Graph container not found!");
-      return;
-    }
-
+    const json = await fetch_graph(null);
     init_graph(json, container);
   }
 });
 
+/**
+ * Event listener for HTMX after a request. Any mutation (uploads, new nodes,
+ * deletes) is followed by fetching only the element changes since then.
+ *
+ * @param {CustomEvent} event - The HTMX `htmx:afterRequest` event.
+ */
+document.addEventListener("htmx:afterRequest", (event) => {
+  if (event.detail.successful && event.detail.requestConfig.verb !== "get") {
+    sync_graph();
+  }
+});
+
 function init_graph(graphData, container) {
   const theme = /** @type {keyof CatppuccinThemes} */ (window.theme);
 
+  if (cy) {
+    cy.destroy();
+  }
+  graphVersion = graphData?.version ?? 0;
+
   /**
    * Initialize Cytoscape instance.
    * @type {import('cytoscape').Core}
    */
-  const cy = cytoscape({
+  cy = cytoscape({
     container: container,
-    elements: /** @type {Array} */ (graphData),
-    layout: {
-      name: "dagre",
-      rankDir: "LR", // Left-to-right instead of Top-to-bottom
-      nodeSep: 50, // Space between nodes
-      edgeSep: 10, // Space between edges
-      rankSep: 200, // Space between hierarchical levels
-    },
+    elements: /** @type {Array} */ (graphData?.elements),
+    layout: GRAPH_LAYOUT,
     style: [
       // Background color
       {
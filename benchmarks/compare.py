@@ -0,0 +1,57 @@
+"""Compare two result files of `benchmarks.suite` and flag regressions.
+
+Run from the repo root with `python -m benchmarks.compare baseline.json candidate.json [--threshold 0.1]`.
+Exits with status 1 when any case got slower than the threshold allows.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import orjson
+
+# NOTE: Cases faster than this are dominated by timer noise and never count as regressions
+MIN_SIGNIFICANT_SECONDS = 0.0005
+
+
+def load_results(path: Path) -> dict[tuple[str, int], float]:
+    data = orjson.loads(path.read_bytes())
+    return {(r["case"], r["size"]): r["min_s"] for r in data["results"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown of the min time that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+
+    regressions = 0
+    print(f"{'case':>28} {'size':>10} {'base ms':>11} {'new ms':>11} {'change':>8}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        base_s, new_s = baseline[key], candidate[key]
+        change = new_s / base_s - 1
+        regressed = change > args.threshold and new_s > MIN_SIGNIFICANT_SECONDS
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        case, size = key
+        print(f"{case:>28} {size:>10} {base_s * 1000:>11.3f} {new_s * 1000:>11.3f} {change:>+8.1%}{flag}")
+
+    for case, size in sorted(baseline.keys() ^ candidate.keys()):
+        only_in = "baseline" if (case, size) in baseline else "candidate"
+        print(f"{case:>28} {size:>10} only in {only_in}")
+
+    print(f"{regressions} regressions above {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""Seeded synthetic tables shared by the benchmarks and the load test."""
+
+import datetime
+
+import polars as pl
+
+
+def make_df(n_rows: int, seed: int = 0) -> pl.DataFrame:
+    """Numeric, categorical, temporal and boolean columns with a fixed seed."""
+    idx = pl.int_range(n_rows, eager=True)
+    return pl.DataFrame(
+        {
+            "num_a": idx.shuffle(seed).cast(pl.Float64) / n_rows,
+            "num_b": idx.shuffle(seed + 1).cast(pl.Float64).sqrt(),
+            "num_c": (idx.shuffle(seed + 2) % 1000).cast(pl.Int64),
+            "cat_a": (idx.shuffle(seed + 3) % 20).cast(pl.String).cast(pl.Categorical),
+            "cat_b": (idx.shuffle(seed + 4) % 50).cast(pl.String),
+            "ts": pl.datetime_range(
+                datetime.datetime(2024, 1, 1),
+                datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=n_rows - 1),
+                "1s",
+                eager=True,
+            ),
+            "flag": idx.shuffle(seed + 5) % 2 == 0,
+        },
+    )
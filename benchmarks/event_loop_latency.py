@@ -0,0 +1,89 @@
+"""Measure latency of a light request while heavy chart renders run on the same event loop.
+
+Each light request mirrors `GET /graph/` and each heavy one mirrors a cold `/pages/chart` render.
+Heavy renders run either inline on the loop, as before, or through the compute pool.
+
+Run from the repo root with `python -m benchmarks.event_loop_latency`.
+"""
+
+import asyncio
+import statistics
+import time
+
+import polars as pl
+
+from app.dependencies.chart_cache import chart_cache, get_chart_html, render_chart
+from app.dependencies.specs.chart import ChartKind, ChartScatter
+from app.dependencies.specs.graph import Graph, GraphNode, KindNode
+from app.dependencies.specs.table import KindTable, StoredTable
+
+N_ROWS = 2_000_000
+N_HEAVY = 8
+LIGHT_INTERVAL_SECONDS = 0.005
+
+
+def make_graph() -> tuple[Graph, list[str]]:
+    g = Graph()
+    chart_ids = []
+    for i in range(N_HEAVY):
+        # NOTE: One table per chart so every render is a cold cache miss
+        df = pl.select(
+            x=pl.int_range(N_ROWS).shuffle(seed=i).cast(pl.Float64),
+            y=pl.int_range(N_ROWS).shuffle(seed=N_HEAVY + i).cast(pl.Float64),
+        )
+        table = StoredTable.from_df(df)
+        table_id = g.add_node(GraphNode(f"table_{i}", KindNode.TABLE, KindTable.UPLOADED, table))
+        chart = ChartScatter.default(table.stats.schema())
+        chart_id = g.add_node(GraphNode(f"scatter_{i}", KindNode.CHART, ChartKind.SCATTER, chart))
+        g.add_edge(table_id, chart_id)
+        chart_ids.append(chart_id)
+    return g, chart_ids
+
+
+async def heavy_inline(g: Graph, chart_id: str) -> None:
+    chart = g.get_node_data(chart_id).data
+    render_chart(chart, g.table_source(g.get_parents(chart_id)[0][0]))
+
+
+async def heavy_pooled(g: Graph, chart_id: str) -> None:
+    await get_chart_html(g, chart_id)
+
+
+async def light(g: Graph, latencies: list[float], done: asyncio.Event) -> None:
+    while not done.is_set():
+        start = time.perf_counter()
+        # NOTE: Yield once like a real request would before the handler body runs
+        await asyncio.sleep(0)
+        g.to_cytoscape()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(LIGHT_INTERVAL_SECONDS)
+
+
+async def run(mode: str) -> list[float]:
+    g, chart_ids = make_graph()
+    heavy = heavy_inline if mode == "inline" else heavy_pooled
+    latencies: list[float] = []
+    done = asyncio.Event()
+    light_task = asyncio.create_task(light(g, latencies, done))
+    await asyncio.gather(*(heavy(g, chart_id) for chart_id in chart_ids))
+    done.set()
+    await light_task
+    for _, node in g.get_nodes_by_kind(KindNode.TABLE):
+        node.data.drop()
+    chart_cache._entries.clear()
+    return latencies
+
+
+def main() -> None:
+    print(f"{'mode':>8} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for mode in ["inline", "pooled"]:
+        latencies = asyncio.run(run(mode))
+        p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+        print(
+            f"{mode:>8} {len(latencies):>9} {statistics.median(latencies):>9.2f} "
+            f"{p99:>9.2f} {max(latencies):>9.2f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
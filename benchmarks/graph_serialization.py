@@ -0,0 +1,105 @@
+"""Compare dump/load time and blob size of the graph format against pickle.
+
+Run from the repo root with `python -m benchmarks.graph_serialization`.
+"""
+
+import pickle
+import timeit
+from collections.abc import Callable
+
+import polars as pl
+
+from app.dependencies.serialization import dump_graph, load_graph
+from app.dependencies.specs.analysis import (
+    AnalysisFilter,
+    FilterOperation,
+    FilterPredicate,
+    KindAnalysis,
+    TableCol,
+)
+from app.dependencies.specs.chart import ChartHeatmap, ChartKind, ChartScatter
+from app.dependencies.specs.graph import Graph, GraphNode, KindNode
+from app.dependencies.specs.table import (
+    DerivedTable,
+    KindTable,
+    StoredTable,
+    TableStats,
+    compute_table_stats,
+)
+
+GRAPH_SIZES = [10, 100, 1000]
+REPEATS = 20
+
+
+def table_stats() -> TableStats:
+    return compute_table_stats(
+        pl.LazyFrame(
+            {
+                **{f"num_{i}": [1.0, 2.0] for i in range(10)},
+                **{f"cat_{i}": ["a", "b"] for i in range(10)},
+            },
+        ),
+    )
+
+
+def make_graph(n_nodes: int, shared_stats: bool = False) -> Graph:
+    """Repeat a `table -> filter -> result -> chart -> chart` chain until `n_nodes` exist.
+
+    Every table gets its own stats like real uploads do, `shared_stats` reuses one `TableStats`
+    object for all of them, which pickle only writes once.
+    """
+    g = Graph()
+    shared = table_stats()
+    while len(g) < n_nodes:
+        stats = shared if shared_stats else table_stats()
+        cols = stats.names()
+        schema = stats.schema()
+        # NOTE: Table ids are fake, the benchmark never touches the table store
+        table_id = g.add_node(
+            GraphNode("table", KindNode.TABLE, KindTable.UPLOADED, StoredTable("bench", stats)),
+        )
+        preds = [FilterPredicate(TableCol(c, cols), FilterOperation.GT, 1.0) for c in cols[:3]]
+        filter_id = g.add_node(
+            GraphNode("filter", KindNode.ANALYSIS, KindAnalysis.FILTER, AnalysisFilter(preds)),
+        )
+        result_id = g.add_node(
+            GraphNode("result", KindNode.TABLE, KindTable.CALCULATED, DerivedTable()),
+        )
+        scatter_id = g.add_node(
+            GraphNode("scatter", KindNode.CHART, ChartKind.SCATTER, ChartScatter.default(schema)),
+        )
+        heatmap_id = g.add_node(
+            GraphNode("heatmap", KindNode.CHART, ChartKind.HEATMAP, ChartHeatmap.default(schema)),
+        )
+        g.add_edge(table_id, filter_id)
+        g.add_edge(filter_id, result_id)
+        g.add_edge(result_id, scatter_id)
+        g.add_edge(result_id, heatmap_id)
+    return g
+
+
+def _time_ms(fn: Callable[[], object]) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=REPEATS)) * 1000
+
+
+def main() -> None:
+    print(f"{'nodes':>6} {'stats':>7} {'format':>8} {'dump ms':>9} {'load ms':>9} {'size KiB':>9}")
+    cases = [(n_nodes, False) for n_nodes in GRAPH_SIZES] + [(GRAPH_SIZES[-1], True)]
+    for n_nodes, shared_stats in cases:
+        g = make_graph(n_nodes, shared_stats)
+        stats_label = "shared" if shared_stats else "own"
+        for name, dump, load in [
+            ("pickle", pickle.dumps, pickle.loads),
+            ("mydat", dump_graph, load_graph),
+        ]:
+            blob = dump(g)
+            dump_ms = _time_ms(lambda: dump(g))
+            load_ms = _time_ms(lambda: load(blob))
+            print(
+                f"{len(g):>6} {stats_label:>7} {name:>8} {dump_ms:>9.3f} {load_ms:>9.3f} "
+                f"{len(blob) / 1024:>9.1f}",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Replay scripted analyst sessions against the app in-process and report throughput and latency.
+
+Every virtual user has its own `user_id` cookie and repeatedly uploads a CSV, filters it, builds and
+tweaks a chart and pages through the tables. Concurrency is ramped through `--levels` and each
+level reports requests per second, p50/p95/p99 per route and the peak RSS of the process.
+
+Run from the repo root with `python -m benchmarks.load_test [--levels 1 4 16] [--rows 100000]`.
+"""
+
+import os
+import tempfile
+
+# NOTE: Must be set before the app modules create their engine, table store and loggers
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="mydat-load-")
+os.environ.setdefault("MYDAT_DATA_DIR", _SCRATCH_DIR)
+os.environ.setdefault("MYDAT_LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import io
+import math
+import re
+import resource
+import shutil
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+
+import httpx
+import orjson
+
+from app.main import application
+from benchmarks.data import make_df
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+SESSIONS_PER_USER = 3
+CSV_ROWS = 100_000
+CHART_ID_PATTERN = re.compile(r'<span id="chart_id" class="sr-only">([^<]+)</span>')
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: Kilobytes on Linux but bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+class Recorder:
+    def __init__(self) -> None:
+        """Latency of every request per route label and count of every status code."""
+        self.timings: defaultdict[str, list[float]] = defaultdict(list)
+        self.statuses: Counter[int] = Counter()
+        self.failed_sessions = 0
+        self.errors: Counter[str] = Counter()
+
+    async def call(
+        self,
+        client: httpx.AsyncClient,
+        route: str,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        method, url = route.split(" ", 1)
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.timings[route].append(time.perf_counter() - start)
+        self.statuses[response.status_code] += 1
+        response.raise_for_status()
+        return response
+
+
+def newest_node(graph_json: dict[str, Any], kind: str) -> str:
+    nodes = [n["data"] for n in graph_json["elements"]["nodes"] if n["data"]["kind"] == kind]
+    return nodes[-1]["id"]
+
+
+async def run_session(client: httpx.AsyncClient, rec: Recorder, csv_bytes: bytes) -> None:
+    await rec.call(client, "GET /")
+    upload = {"uploaded_file": ("sales.csv", csv_bytes, "text/csv")}
+    await rec.call(client, "POST /files/upload", files=upload)
+    graph_json = (await rec.call(client, "GET /graph/")).json()
+    table_id = newest_node(graph_json, "table")
+
+    filter_form = {
+        "new_filter_src": table_id,
+        "gc_filter_src": ["num_a", "num_c"],
+        "new_filter_op": [">", "<"],
+        "new_filter_comp": ["0.25", "900"],
+    }
+    created = (await rec.call(client, "POST /graph/create/filter", data=filter_form)).json()
+    result_id = created["result_id"]
+
+    chart_form = {"chart_selection_radio": "scatter", "chart_src_selector": result_id}
+    chart_page = await rec.call(client, "POST /charts/create", data=chart_form)
+    match = CHART_ID_PATTERN.search(chart_page.text)
+    assert match is not None, "Chart page is missing the chart id"
+    chart_id = match.group(1)
+    for x in ["num_b", "num_c", "num_a"]:
+        update_form = {"chart_id": chart_id, "dimension_name": "x", "dimension_value": x}
+        await rec.call(client, "POST /charts/update", data=update_form)
+
+    for node_id, subkind in [(table_id, "uploaded"), (result_id, "calculated")]:
+        view_params = {"node_id": node_id, "node_kind": "table", "node_subkind": subkind}
+        await rec.call(client, "GET /graph/view", params=view_params)
+    sort_params = {"node_id": table_id, "sort_by": "num_b", "descending": "true"}
+    await rec.call(client, "GET /graph/view/table", params=sort_params)
+    await rec.call(client, "GET /graph/view/rows", params={**sort_params, "offset": 50})
+
+    await rec.call(client, "GET /pages/chart", params={"chart_id": chart_id})
+    await rec.call(client, "GET /pages/dataflow")
+
+
+async def run_user(rec: Recorder, csv_bytes: bytes, n_sessions: int) -> None:
+    transport = httpx.ASGITransport(app=application)
+    # NOTE: The app doesn't set the `user_id` cookie on routes that return their own Response,
+    # so every virtual user brings its own, otherwise each request would start an empty graph
+    cookies = {"user_id": str(uuid.uuid4())}
+    async with httpx.AsyncClient(
+        transport=transport,
+        base_url="http://loadtest",
+        cookies=cookies,
+    ) as client:
+        for _ in range(n_sessions):
+            try:
+                await run_session(client, rec, csv_bytes)
+            except Exception as e:
+                # NOTE: One broken session is counted and the user moves on, the level keeps running
+                rec.failed_sessions += 1
+                rec.errors[type(e).__name__] += 1
+
+
+def report(level: int, rec: Recorder, elapsed: float) -> dict[str, Any]:
+    n_requests = sum(len(t) for t in rec.timings.values())
+    print(
+        f"\n{level} concurrent users: {n_requests / elapsed:.1f} req/s over {elapsed:.1f}s, "
+        f"{rec.failed_sessions} failed sessions {dict(rec.errors)}, "
+        f"statuses {dict(sorted(rec.statuses.items()))}, "
+        f"peak RSS {peak_rss_mib():.0f} MiB",
+    )
+    print(f"{'route':>26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    routes = {}
+    for route, timings in sorted(rec.timings.items()):
+        timings.sort()
+        p50, p95, p99 = (percentile(timings, q) * 1000 for q in (0.5, 0.95, 0.99))
+        print(f"{route:>26} {len(timings):>6} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f}")
+        routes[route] = {"count": len(timings), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+    return {
+        "users": level,
+        "requests_per_second": n_requests / elapsed,
+        "failed_sessions": rec.failed_sessions,
+        "errors": dict(rec.errors),
+        "statuses": {str(k): v for k, v in rec.statuses.items()},
+        "peak_rss_mib": peak_rss_mib(),
+        "routes": routes,
+    }
+
+
+async def ramp(levels: list[int], n_sessions: int, csv_bytes: bytes) -> list[dict[str, Any]]:
+    results = []
+    # NOTE: ASGITransport doesn't send lifespan events, so startup and shutdown are driven here
+    async with application.router.lifespan_context(application):
+        for level in levels:
+            rec = Recorder()
+            start = time.perf_counter()
+            await asyncio.gather(*(run_user(rec, csv_bytes, n_sessions) for _ in range(level)))
+            results.append(report(level, rec, time.perf_counter() - start))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--sessions-per-user", type=int, default=SESSIONS_PER_USER)
+    parser.add_argument("--rows", type=int, default=CSV_ROWS)
+    parser.add_argument("--out", type=Path, default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    buffer = io.BytesIO()
+    make_df(args.rows).write_csv(buffer)
+    try:
+        results = asyncio.run(ramp(args.levels, args.sessions_per_user, buffer.getvalue()))
+    finally:
+        shutil.rmtree(_SCRATCH_DIR, ignore_errors=True)
+
+    if args.out is not None:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"rows": args.rows, "levels": results}
+        args.out.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
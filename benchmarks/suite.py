@@ -0,0 +1,199 @@
+"""Time ingestion, analysis, chart building, rendering and persistence on synthetic data.
+
+Results are written as JSON so later runs can be checked with `benchmarks.compare`.
+
+Run from the repo root with `python -m benchmarks.suite [--max-rows 1000000] [--out results.json]`.
+"""
+
+import os
+import tempfile
+
+# NOTE: Must be set before the app modules create their engine and loggers
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="mydat-bench-")
+# NOTE: The DB, the table store and the template bytecode cache all live under the data dir
+os.environ.setdefault("MYDAT_DATA_DIR", _SCRATCH_DIR)
+os.environ.setdefault("MYDAT_LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import datetime
+import platform
+import shutil
+import statistics
+import subprocess
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import orjson
+import plotly
+import polars as pl
+
+from app.db.session import create_db_and_tables, engine
+from app.dependencies.ingest import store_csv
+from app.dependencies.specs.analysis import AnalysisFilter, FilterOperation, FilterPredicate, TableCol
+from app.dependencies.specs.chart import (
+    ChartBar,
+    ChartHeatmap,
+    ChartHistogram,
+    ChartKind,
+    ChartScatter,
+    fig_html,
+)
+from app.dependencies.specs.graph import Graph, GraphNode, KindNode
+from app.dependencies.specs.table import compute_table_stats
+from app.dependencies.state import StateManager
+from app.templates.renderer import render
+from benchmarks.data import make_df
+from benchmarks.graph_serialization import make_graph
+
+ROW_COUNTS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+GRAPH_SIZES = [10, 100, 1000]
+N_PREDICATES = 20
+# NOTE: Repeats shrink with size so the 1e7 cases still finish in reasonable time
+TARGET_SECONDS_PER_CASE = 2.0
+MAX_REPEATS = 20
+CHART_CLASSES = [ChartScatter, ChartBar, ChartHistogram, ChartHeatmap]
+
+Result = dict[str, str | int | float]
+
+
+def time_case(fn: Callable[[], object]) -> list[float]:
+    """Wall times in seconds of repeated calls, at least 3 and at most `MAX_REPEATS`."""
+    timings = []
+    deadline = time.perf_counter() + TARGET_SECONDS_PER_CASE
+    while len(timings) < MAX_REPEATS and (len(timings) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def add_result(results: list[Result], case: str, size: int, timings: list[float]) -> None:
+    min_s, median_s = min(timings), statistics.median(timings)
+    results.append(
+        {"case": case, "size": size, "min_s": min_s, "median_s": median_s, "repeats": len(timings)},
+    )
+    print(f"{case:>28} {size:>10} {min_s * 1000:>11.3f} {median_s * 1000:>11.3f} {len(timings):>4}")
+
+
+def record(results: list[Result], case: str, size: int, fn: Callable[[], object]) -> None:
+    add_result(results, case, size, time_case(fn))
+
+
+def bench_table(results: list[Result], n_rows: int, scratch: Path) -> None:
+    df = make_df(n_rows)
+    csv_path = scratch / f"bench_{n_rows}.csv"
+    df.write_csv(csv_path)
+    record(results, "ingest.read_csv", n_rows, lambda: pl.read_csv(csv_path))
+
+    stored = []
+    record(results, "ingest.store_csv", n_rows, lambda: stored.append(store_csv(csv_path)))
+    for table in stored:
+        table.drop()
+
+    stats = compute_table_stats(df.lazy())
+    cols = stats.names()
+    # NOTE: Thresholds inside the lower quarter of each column's range so no predicate is pruned
+    # by the stats and every one of them has to be evaluated
+    preds = []
+    for i in range(N_PREDICATES):
+        col_stats = stats.get(["num_a", "num_b", "num_c"][i % 3])
+        assert col_stats is not None
+        value = col_stats.min + (col_stats.max - col_stats.min) * i / (4 * N_PREDICATES)
+        preds.append(FilterPredicate(TableCol(col_stats.name, cols), FilterOperation.GT, value))
+    analysis = AnalysisFilter(preds)
+    record(
+        results,
+        f"analysis.filter_{N_PREDICATES}",
+        n_rows,
+        lambda: analysis.apply(df.lazy(), stats).collect(),
+    )
+
+    for chart_cls in CHART_CLASSES:
+        chart = chart_cls.default(stats.schema())
+        kind = ChartKind[chart_cls.__name__.removeprefix("Chart").upper()]
+        name = kind.value.lower()
+        # NOTE: Without a source key the heatmap aggregation cache is bypassed, so every call aggregates
+        record(results, f"chart.{name}.make_fig", n_rows, lambda: chart.make_fig(df))
+        fig = chart.make_fig(df)
+        record(results, f"chart.{name}.fig_html", n_rows, lambda: fig_html(fig))
+        chart_html = fig_html(fig)
+        node = GraphNode(name, KindNode.CHART, kind, chart)
+        context = {"request": None, "chart": node, "chart_id": "bench", "actual_chart": chart_html}
+        record(
+            results,
+            f"chart.{name}.render",
+            n_rows,
+            lambda: render({"template_name": "page_chart.jinja", "context": context}),
+        )
+    csv_path.unlink()
+
+
+async def bench_state(results: list[Result]) -> None:
+    await create_db_and_tables()
+    manager = StateManager(max_resident_bytes=2**62, idle_ttl_seconds=float("inf"))
+    for n_nodes in GRAPH_SIZES:
+        user_id = f"bench-{n_nodes}"
+        graph = make_graph(n_nodes)
+        timings: dict[str, list[float]] = {"persist": [], "load": []}
+        for _ in range(MAX_REPEATS):
+            graph.touch()
+            manager._update_user_graph(user_id, graph)
+            start = time.perf_counter()
+            await manager.checkpoint()
+            timings["persist"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await manager._load_graph_from_db(user_id)
+            timings["load"].append(time.perf_counter() - start)
+        for stage, stage_timings in timings.items():
+            add_result(results, f"state.{stage}", len(graph), stage_timings)
+    await engine.dispose()
+
+
+def environment() -> dict[str, str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "plotly": plotly.__version__,
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpus)",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=ROW_COUNTS[-1])
+    parser.add_argument("--out", type=Path, default=Path("benchmarks/results/latest.json"))
+    args = parser.parse_args()
+
+    results: list[Result] = []
+    print(f"{'case':>28} {'size':>10} {'min ms':>11} {'median ms':>11} {'runs':>4}")
+    scratch = Path(_SCRATCH_DIR)
+    try:
+        for n_rows in ROW_COUNTS:
+            if n_rows <= args.max_rows:
+                bench_table(results, n_rows, scratch)
+        asyncio.run(bench_state(results))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_bytes(
+        orjson.dumps({"environment": environment(), "results": results}, option=orjson.OPT_INDENT_2),
+    )
+    print(f"Wrote {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import math
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from app.dependencies.specs.analysis import AnalysisFilter, FilterOperation, FilterPredicate, TableCol
+from app.dependencies.specs.table import compute_table_stats
+
+
+@pytest.fixture
+def lf() -> pl.LazyFrame:
+    return pl.LazyFrame({"x": [1.0, 2.0, math.nan, None, 3.0]})
+
+
+def test_stats_count_nans(lf: pl.LazyFrame) -> None:
+    stats = compute_table_stats(lf).get("x")
+    assert stats is not None
+    assert stats.nan_count == 1
+    assert stats.max == 3.0
+
+
+@pytest.mark.parametrize("op", list(FilterOperation))
+@pytest.mark.parametrize("value", [0.0, 2.0, 10.0])
+def test_pruned_filter_matches_unpruned(lf: pl.LazyFrame, op: FilterOperation, value: float) -> None:
+    # NOTE: NaN compares greater than every number, so min/max alone must not decide predicates
+    pred = FilterPredicate(TableCol("x", ["x"]), op, value)
+    stats = compute_table_stats(lf)
+    assert pred.decide(stats.get("x")) is None
+
+    pruned = AnalysisFilter([pred]).apply(lf, stats).collect()
+    unpruned = AnalysisFilter([pred]).apply(lf).collect()
+    assert_frame_equal(pruned, unpruned)
+
+
+def test_stats_keep_exact_integer_bounds() -> None:
+    stats = compute_table_stats(pl.LazyFrame({"x": [1, 2**53 + 1]})).get("x")
+    assert stats is not None
+    assert stats.max == 2**53 + 1
+    assert isinstance(stats.max, int)
+
+
+@pytest.mark.parametrize("op", list(FilterOperation))
+@pytest.mark.parametrize("value", [2**53, 2**53 + 1, float(2**53 + 1), 2**53 + 2])
+def test_pruned_filter_matches_unpruned_beyond_float_precision(op: FilterOperation, value: float) -> None:
+    # NOTE: Polars compares the int column with float values as floats, which rounds beyond 2^53
+    lf = pl.LazyFrame({"x": [2**53 - 2, 2**53 + 1]})
+    pred = FilterPredicate(TableCol("x", ["x"]), op, value)
+    stats = compute_table_stats(lf)
+
+    pruned = AnalysisFilter([pred]).apply(lf, stats).collect()
+    unpruned = AnalysisFilter([pred]).apply(lf).collect()
+    assert_frame_equal(pruned, unpruned)
@@ -0,0 +1,40 @@
+import struct
+
+import orjson
+import pytest
+
+from app.dependencies.serialization import MAGIC, dump_graph, load_graph
+from app.dependencies.specs.encoding import encode_spec
+from app.dependencies.specs.graph import Graph
+from benchmarks.graph_serialization import make_graph
+
+
+@pytest.fixture
+def graph() -> Graph:
+    return make_graph(10)
+
+
+def assert_same_graph(loaded: Graph, graph: Graph) -> None:
+    assert loaded.version == graph.version
+    assert loaded.edges() == graph.edges()
+    assert [(node_id, rec.node) for node_id, rec in loaded.nodes.items()] == [
+        (node_id, rec.node) for node_id, rec in graph.nodes.items()
+    ]
+
+
+def test_round_trip(graph: Graph) -> None:
+    loaded = load_graph(dump_graph(graph))
+    assert_same_graph(loaded, graph)
+    # NOTE: A loaded graph matches its snapshot, nothing to send to clients or clean up
+    assert loaded.changes_since(loaded.version) == []
+    assert loaded.unpersisted_tables() == []
+
+
+def test_loads_format_version_1(graph: Graph) -> None:
+    payload = {
+        "version": graph.version,
+        "nodes": [[node_id, encode_spec(rec.node)] for node_id, rec in graph.nodes.items()],
+        "edges": graph.edges(),
+    }
+    blob = MAGIC + struct.pack(">H", 1) + orjson.dumps(payload)
+    assert_same_graph(load_graph(blob), graph)